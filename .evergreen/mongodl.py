@@ -8,6 +8,7 @@ Can also be imported and used as a module. Refer:
 - class CacheDB         - Manage and query a cache db
 - func infer_target()   - Infer the download target of the host OS
 - func infer_arch()     - Infer the architecture of the host OS
+- func download_components() - Download and extract several components at once
 - user_caches_root()    - Where programs should put their cache data
 - default_cache_dir()   - Default directory for mongodl cache data
 
@@ -15,25 +16,36 @@ Use '--help' for more information.
 """
 
 import argparse
+import base64
 import enum
+import functools
+import gzip
 import hashlib
+import http.client
+import io
 import json
 import logging
+import math
 import os
 import platform
 import re
 import shutil
+import signal
 import sqlite3
 import ssl
+import subprocess
 import sys
 import tarfile
 import textwrap
+import threading
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
 import warnings
 import zipfile
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from fnmatch import fnmatch
 from pathlib import Path, PurePath, PurePosixPath
@@ -49,6 +61,11 @@ from typing import (
     cast,
 )
 
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
 
@@ -60,6 +77,28 @@ try:
 except ImportError:
     pass
 
+# Optional gzip implementations that are faster than the zlib module and can
+# decompress in a background thread.
+try:
+    from isal import igzip_threaded as isal_gzip
+except ImportError:
+    isal_gzip = None
+try:
+    from zlib_ng import gzip_ng_threaded as zlib_ng_gzip
+except ImportError:
+    zlib_ng_gzip = None
+
+# An optional iterative JSON parser, used to import full.json without holding
+# the whole document in memory.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+#: The decompression backends for .tgz archives, in the order of preference.
+#: Set MONGODL_DECOMPRESSOR to one of these to force a backend.
+DECOMPRESSORS = ("isal", "zlib-ng", "pigz", "gzip", "python")
+
 # These versions are used for performance benchmarking. Do not update to a newer version.
 PERF_VERSIONS = {"v6.0-perf": "6.0.6", "v8.0-perf": "8.0.1"}
 
@@ -249,9 +288,48 @@ def default_cache_dir() -> Path:
     return user_caches_root().joinpath("mongodl").absolute()
 
 
+def parse_size(size: str) -> int:
+    """
+    Parse a size in bytes with an optional "K", "M", "G" or "T" suffix (powers
+    of 1024), e.g. "500M" or "10G".
+    """
+    mat = re.match(r"(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?$", size.strip(), re.IGNORECASE)
+    if mat is None:
+        raise ValueError(f"Invalid size: {size!r}")
+    num, unit = mat.groups()
+    return int(float(num) * 1024 ** " KMGT".index(unit.upper() or " "))
+
+
+def default_cache_max_size() -> "int | None":
+    """
+    Get the size budget of the mongodl cache from the MONGODL_CACHE_MAX_SIZE
+    environment variable, or None if there is no limit.
+    """
+    size = os.environ.get("MONGODL_CACHE_MAX_SIZE")
+    return parse_size(size) if size else None
+
+
+def default_metadata_ttl() -> "float | None":
+    """
+    Get how long a downloaded full.json is trusted without revalidation, from
+    the MONGODL_METADATA_TTL environment variable (in seconds), or None if it
+    is not set.
+    """
+    ttl = os.environ.get("MONGODL_METADATA_TTL")
+    return float(ttl) if ttl else None
+
+
+def default_offline() -> bool:
+    """
+    Whether the MONGODL_OFFLINE environment variable asks to only use cached files.
+    """
+    return os.environ.get("MONGODL_OFFLINE", "") not in ("", "0", "false")
+
+
 if TYPE_CHECKING:
     DownloadResult = NamedTuple(
-        "DownloadResult", [("is_changed", bool), ("path", Path)]
+        "DownloadResult",
+        [("is_changed", bool), ("path", Path), ("sha256", "str | None")],
     )
     DownloadableComponent = NamedTuple(
         "DownloadableComponent",
@@ -264,12 +342,59 @@ if TYPE_CHECKING:
             ("data_json", str),
         ],
     )
+    ComponentSpec = NamedTuple(
+        "ComponentSpec",
+        [
+            ("component", str),
+            ("version", str),
+            ("out", Path),
+            ("pattern", "str | None"),
+            ("strip_components", int),
+            ("edition", str),
+            ("target", "str | None"),
+            ("arch", "str | None"),
+            ("latest_build_branch", "str | None"),
+        ],
+    )
 else:
-    DownloadResult = namedtuple("DownloadResult", ["is_changed", "path"])
+    DownloadResult = namedtuple(
+        "DownloadResult", ["is_changed", "path", "sha256"], defaults=[None]
+    )
     DownloadableComponent = namedtuple(
         "DownloadableComponent",
         ["version", "target", "arch", "edition", "key", "data_json"],
     )
+    ComponentSpec = namedtuple(
+        "ComponentSpec",
+        [
+            "component",
+            "version",
+            "out",
+            "pattern",
+            "strip_components",
+            "edition",
+            "target",
+            "arch",
+            "latest_build_branch",
+        ],
+        defaults=[None, 0, "enterprise", None, None, None],
+    )
+
+#: The version of the schema of the tables that are imported from full.json
+SCHEMA_VERSION = 4
+#: The maximum number of components that are downloaded and extracted at once
+DEFAULT_JOBS = 4
+#: How long (in seconds) a downloaded full.json is trusted without asking the
+#: server whether it changed, if neither MONGODL_METADATA_TTL nor the
+#: Cache-Control header of the server gives a lifetime.
+DEFAULT_METADATA_TTL = 0
+#: Files smaller than this are never downloaded as several byte ranges
+SEGMENT_MIN_SIZE = 32 * 1024 * 1024
+#: The chunk size used when copying and hashing downloaded files
+COPY_BUFSIZE = 1024 * 1024
+#: Linux ioctl() request that makes a file share the data blocks of another one
+#: (a reflink), on file systems that support it such as Btrfs and XFS
+FICLONE = 0x40049409
 
 #: Regular expression that matches the version numbers from 'full.json'
 VERSION_RE = re.compile(r"(\d+)\.(\d+)\.(\d+)(?:-([a-z]+)(\d+))?")
@@ -298,24 +423,23 @@ def version_tup(version: str) -> "tuple[int, int, int, int, int]":
     return tuple(map(int, (major, minor, patch, tag, tagnum)))
 
 
-def collate_mdb_version(left: str, right: str) -> int:
-    lhs = version_tup(left)
-    rhs = version_tup(right)
-    if lhs < rhs:
-        return -1
-    if lhs > rhs:
-        return 1
-    return 0
-
-
-def mdb_version_not_rc(version: str) -> bool:
-    tup = version_tup(version)
-    return tup[-1] == STABLE_MAX_RC
+def version_sort_key(version: str) -> int:
+    """
+    Get an integer that sorts in the same order as the version tuple of 'version'.
+    """
+    major, minor, patch, tag, tagnum = version_tup(version)
+    # Stable releases sort after alpha, beta, and rc releases of the same version.
+    tag = min(tag, 9)
+    return (((major * 1000 + minor) * 1000 + patch) * 10 + tag) * 10000 + tagnum
 
 
-def mdb_version_rapid(version: str) -> bool:
+def version_flags(version: str) -> "tuple[bool, bool]":
+    """
+    Get whether 'version' is a pre-release (alpha/beta/rc), and whether it is a
+    rapid release.
+    """
     tup = version_tup(version)
-    return tup[1] > 0
+    return tup[3] != STABLE_MAX_RC, tup[1] > 0
 
 
 class DownloadRetrier:
@@ -353,16 +477,52 @@ class CacheDB:
         """
         Open a caching database at the given filepath.
         """
-        db = sqlite3.connect(str(fpath), isolation_level=None)
+        # The cache may be shared by several processes. Wait for locks held by
+        # others rather than failing, and use WAL so that readers never block.
+        db = sqlite3.connect(str(fpath), isolation_level=None, timeout=120)
+        db.execute("PRAGMA journal_mode=WAL")
         db.execute(r"""
             CREATE TABLE IF NOT EXISTS mdl_http_downloads (
             url TEXT NOT NULL UNIQUE,
             etag TEXT,
-            last_modified TEXT
+            last_modified TEXT,
+            sha256 TEXT,
+            size INTEGER,
+            last_access REAL,
+            validated REAL,
+            max_age REAL
+        )""")
+        columns = [
+            row[1] for row in db.execute("PRAGMA table_info(mdl_http_downloads)")
+        ]
+        # Caches created by older versions do not record digests, sizes,
+        # access times, validation times or freshness lifetimes.
+        for column, typ in [
+            ("sha256", "TEXT"),
+            ("size", "INTEGER"),
+            ("last_access", "REAL"),
+            ("validated", "REAL"),
+            ("max_age", "REAL"),
+        ]:
+            if column in columns:
+                continue
+            try:
+                db.execute(f"ALTER TABLE mdl_http_downloads ADD COLUMN {column} {typ}")
+            except sqlite3.OperationalError as e:
+                # Another process added the column first.
+                if "duplicate column" not in str(e):
+                    raise
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_partial_downloads (
+            url TEXT NOT NULL UNIQUE,
+            validator TEXT
+        )""")
+        db.execute(r"""
+            CREATE TABLE IF NOT EXISTS mdl_extracted (
+            key TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL
         )""")
-        db.create_collation("mdb_version", collate_mdb_version)
-        db.create_function("mdb_version_not_rc", 1, mdb_version_not_rc)
-        db.create_function("mdb_version_rapid", 1, mdb_version_rapid)
         return CacheDB(db)
 
     def __call__(
@@ -383,28 +543,51 @@ class CacheDB:
             return
 
         with self._db:
-            # Must do an explicit BEGIN because isolation_level=None
-            self("BEGIN")
+            # Must do an explicit BEGIN because isolation_level=None. Take the
+            # write lock up front, since other processes may share the cache.
+            self("BEGIN IMMEDIATE")
             yield
 
     def import_json_file(self, json_file: Path) -> None:
         """
         Import the given downloads content from the given JSON file
+
+        The version entries are parsed and written to the database one at a
+        time, so the whole document is never held in memory.
         """
-        with json_file.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        self.import_json_data(data)
+        with json_file.open("rb") as f, self.transaction():
+            self._import_versions(_iter_json_versions(f))
 
     def import_json_data(self, data: "Any") -> None:
         """
         Import the given downloads content from the given JSON-like data
         """
         with self.transaction():
-            self._import_json_data(data)
+            self._import_versions(data["versions"])
 
-    def _import_json_data(self, data: "Any") -> None:
-        # We're reloading everything, so just drop and re-create the tables.
-        # Bonus: We don't have to worry about schema changes
+    def has_version(self, version: str) -> bool:
+        """
+        Whether the exact given version has been imported from full.json.
+        """
+        if not self.schema_is_current():
+            return False
+        rows = self(
+            "SELECT 1 FROM mdl_versions WHERE version=:version", version=version
+        )
+        return next(iter(rows), None) is not None
+
+    def schema_is_current(self) -> bool:
+        """
+        Whether the downloads tables match the schema used by this version of mongodl.
+        """
+        (user_version,) = next(iter(self("PRAGMA user_version")))
+        return user_version == SCHEMA_VERSION
+
+    def _ensure_schema(self) -> None:
+        if self.schema_is_current():
+            return
+        # The tables only hold data imported from full.json, so just drop and
+        # re-create them when the schema changes.
         self("DROP TABLE IF EXISTS mdl_components")
         self("DROP TABLE IF EXISTS mdl_downloads")
         self("DROP TABLE IF EXISTS mdl_versions")
@@ -413,7 +596,12 @@ class CacheDB:
                 version_id INTEGER PRIMARY KEY,
                 date TEXT NOT NULL,
                 version TEXT NOT NULL,
-                githash TEXT NOT NULL
+                githash TEXT NOT NULL,
+                sort_key INTEGER NOT NULL,
+                is_rc INTEGER NOT NULL,
+                is_rapid INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                UNIQUE(version, githash)
             )
         """)
         self(r"""
@@ -424,8 +612,7 @@ class CacheDB:
                 arch TEXT NOT NULL,
                 edition TEXT NOT NULL,
                 ar_url TEXT NOT NULL,
-                ar_debug_url TEXT,
-                data TEXT NOT NULL
+                ar_debug_url TEXT
             )
         """)
         self(r"""
@@ -437,76 +624,141 @@ class CacheDB:
                 UNIQUE(key, download_id)
             )
         """)
-
-        for ver in data["versions"]:
+        self("CREATE INDEX mdl_versions_sort_key ON mdl_versions (sort_key)")
+        # Downloads are looked up per version, newest first, see iter_available().
+        self(r"""
+            CREATE INDEX mdl_downloads_version
+                ON mdl_downloads (version_id, target, arch, edition)
+        """)
+        self("CREATE INDEX mdl_components_download ON mdl_components (download_id)")
+        self(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _import_versions(self, versions: "Iterable[Any]") -> None:
+        self._ensure_schema()
+        # Find the versions that are already imported. A version is considered
+        # unchanged if the digest of its whole entry in full.json is the same.
+        existing = {
+            (version, githash): (version_id, digest)
+            for version_id, version, githash, digest in self(
+                "SELECT version_id, version, githash, digest FROM mdl_versions"
+            )
+        }
+        next_version_id = max((vid for vid, _ in existing.values()), default=0) + 1
+        (next_download_id,) = next(
+            iter(self("SELECT coalesce(max(download_id), 0) + 1 FROM mdl_downloads"))
+        )
+        known_targets = set(TARGETS_THAT_ARE_NOT_DISTROS)
+        for distro in DISTRO_ID_TO_TARGET.values():
+            known_targets.update(distro.values())
+
+        n_imported = 0
+        seen = set()
+        missing = set()
+        for ver in versions:
             version = ver["version"]
             githash = ver["githash"]
             date = ver["date"]
+            if (version, githash) in seen:
+                continue
+            seen.add((version, githash))
+            found = existing.pop((version, githash), None)
+            for dl in ver["downloads"]:
+                target = dl.get("target", "null")
+                # Normalize RHEL target names to include just the major version.
+                if target.startswith("rhel") and len(target) == 6:
+                    target = target[:-1]
+                if target not in known_targets:
+                    missing.add(target)
+            digest = hashlib.sha256(
+                json.dumps(ver, sort_keys=True, separators=(",", ":")).encode()
+            ).hexdigest()
+            if found is not None and found[1] == digest:
+                # Already imported
+                continue
+            if found is not None:
+                # The entry of this version changed, re-import it.
+                self._delete_versions([found[0]])
+            version_id = next_version_id
+            next_version_id += 1
+            is_rc, is_rapid = version_flags(version)
             self(
                 r"""
-                INSERT INTO mdl_versions (date, version, githash)
-                VALUES (:date, :version, :githash)
+                INSERT INTO mdl_versions (version_id,
+                                          date,
+                                          version,
+                                          githash,
+                                          sort_key,
+                                          is_rc,
+                                          is_rapid,
+                                          digest)
+                VALUES (:version_id,
+                        :date,
+                        :version,
+                        :githash,
+                        :sort_key,
+                        :is_rc,
+                        :is_rapid,
+                        :digest)
                 """,
+                version_id=version_id,
                 date=date,
                 version=version,
                 githash=githash,
+                sort_key=version_sort_key(version),
+                is_rc=is_rc,
+                is_rapid=is_rapid,
+                digest=digest,
             )
-            version_id = self._cursor.lastrowid
-            missing = set()
+            download_rows = []
+            component_rows = []
             for dl in ver["downloads"]:
                 arch = dl.get("arch", "null")
                 target = dl.get("target", "null")
-                # Normalize RHEL target names to include just the major version.
                 if target.startswith("rhel") and len(target) == 6:
                     target = target[:-1]
-                found = False
-                for distro in DISTRO_ID_TO_TARGET.values():
-                    if target in list(distro.values()):
-                        found = True
-                if not found and target not in TARGETS_THAT_ARE_NOT_DISTROS:
-                    missing.add(target)
-                edition = dl["edition"]
-                ar_url = dl["archive"]["url"]
-                ar_debug_url = dl["archive"].get("debug_symbols")
-                self(
-                    r"""
-                    INSERT INTO mdl_downloads (version_id,
-                                               target,
-                                               arch,
-                                               edition,
-                                               ar_url,
-                                               ar_debug_url,
-                                               data)
-                    VALUES (:version_id,
-                            :target,
-                            :arch,
-                            :edition,
-                            :ar_url,
-                            :ar_debug_url,
-                            :data)
-                    """,
-                    version_id=version_id,
-                    target=target,
-                    arch=arch,
-                    edition=edition,
-                    ar_url=ar_url,
-                    ar_debug_url=ar_debug_url,
-                    data=json.dumps(dl),
+                download_rows.append(
+                    (
+                        next_download_id,
+                        version_id,
+                        target,
+                        arch,
+                        dl["edition"],
+                        dl["archive"]["url"],
+                        dl["archive"].get("debug_symbols"),
+                    )
                 )
-                dl_id = self._cursor.lastrowid
-                for key, data in dl.items():
-                    if "url" not in data:
+                for key, comp in dl.items():
+                    if "url" not in comp:
                         # Some fields aren't downloadable items. Skip them
                         continue
-                    self(
-                        r"""
-                        INSERT INTO mdl_components (key, download_id, data)
-                        VALUES (:key, :dl_id, :data)
-                        """,
-                        key=key,
-                        dl_id=dl_id,
-                        data=json.dumps(data),
-                    )
+                    component_rows.append((key, next_download_id, json.dumps(comp)))
+                next_download_id += 1
+            self._db.executemany(
+                r"""
+                INSERT INTO mdl_downloads (download_id,
+                                           version_id,
+                                           target,
+                                           arch,
+                                           edition,
+                                           ar_url,
+                                           ar_debug_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                download_rows,
+            )
+            self._db.executemany(
+                "INSERT INTO mdl_components (key, download_id, data) VALUES (?, ?, ?)",
+                component_rows,
+            )
+            n_imported += 1
+
+        # Whatever is left in 'existing' is no longer in the list.
+        self._delete_versions([vid for vid, _ in existing.values()])
+        LOGGER.debug(
+            "Imported %d new versions, removed %d stale versions",
+            n_imported,
+            len(existing),
+        )
         if missing:
             LOGGER.error("Missing targets in DISTRO_ID_TO_TARGET:")
             for item in missing:
@@ -514,6 +766,21 @@ class CacheDB:
             if os.environ.get("VALIDATE_DISTROS") == "1":
                 sys.exit(1)
 
+    def _delete_versions(self, version_ids: "list[int]") -> None:
+        """
+        Delete the given versions and all of their downloads and components.
+        """
+        rows = [(vid,) for vid in version_ids]
+        self._db.executemany(
+            r"""
+            DELETE FROM mdl_components WHERE download_id IN (
+                SELECT download_id FROM mdl_downloads WHERE version_id=?)
+            """,
+            rows,
+        )
+        self._db.executemany("DELETE FROM mdl_downloads WHERE version_id=?", rows)
+        self._db.executemany("DELETE FROM mdl_versions WHERE version_id=?", rows)
+
     def iter_available(
         self,
         *,
@@ -522,34 +789,42 @@ class CacheDB:
         arch: "str | None" = None,
         edition: "str | None" = None,
         component: "str | None" = None,
+        limit: "int | None" = None,
     ) -> "Iterable[DownloadableComponent]":
         """
         Iterate over the matching downloadable components according to the
-        given attribute filters.
+        given attribute filters, newest first. If 'limit' is given, stop after
+        that many components.
         """
+        # Only filter on the attributes that are given, so that the indexes can
+        # be used for them.
+        clauses = []
+        if component is not None:
+            clauses.append("key=:component")
+        if target is not None:
+            clauses.append("target=:target")
+        if arch is not None:
+            clauses.append("arch=:arch")
+        if edition is not None:
+            clauses.append("edition=:edition")
+        if version == "latest-stable":
+            clauses.append("NOT is_rc")
+        elif version == "rapid":
+            clauses.append("is_rapid")
+        elif version not in (None, "latest-release"):
+            clauses.append("(version=:version OR version LIKE :version_pattern)")
+        # The CROSS JOINs make SQLite walk the versions from newest to oldest
+        # through their sort_key index, so no sorting is needed and a limit
+        # stops the query at the first matches.
         rows = self(
-            r"""
+            rf"""
             SELECT version, target, arch, edition, key, mdl_components.data
-              FROM mdl_components,
-                   mdl_downloads USING(download_id),
-                   mdl_versions USING(version_id)
-            WHERE (:component IS NULL OR key=:component)
-              AND (:target IS NULL OR target=:target)
-              AND (:arch IS NULL OR arch=:arch)
-              AND (:edition IS NULL OR edition=:edition)
-              AND (
-                  CASE
-                    WHEN :version='latest-release'
-                        THEN 1
-                    WHEN :version='latest-stable'
-                        THEN mdb_version_not_rc(version)
-                    WHEN :version='rapid'
-                        THEN mdb_version_rapid(version)
-                    WHEN :version IS NULL
-                        THEN 1
-                    ELSE version=:version OR version LIKE :version_pattern
-                  END)
-            ORDER BY version COLLATE mdb_version DESC
+              FROM mdl_versions
+                   CROSS JOIN mdl_downloads USING(version_id)
+                   CROSS JOIN mdl_components USING(download_id)
+            WHERE {" AND ".join(clauses) or "1"}
+            ORDER BY sort_key DESC
+            LIMIT :limit
             """,
             version=version,
             version_pattern=f"{version}.%",
@@ -557,19 +832,269 @@ class CacheDB:
             arch=arch,
             edition=edition,
             component=component,
+            # A negative limit means no limit
+            limit=-1 if limit is None else limit,
         )
-        for row in rows:
+        # Fetch every row up front so that an abandoned iterator does not keep
+        # a read lock on the database open.
+        for row in list(rows):
             yield DownloadableComponent(*row)  # type: ignore
 
 
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """
+    An HTTPS connection that resumes the last TLS session of its HTTPPool with
+    the same host, to skip the full handshake on new connections.
+    """
+
+    def __init__(
+        self, host: str, port: "int | None", pool: "HTTPPool", timeout: float
+    ) -> None:
+        super().__init__(host, port, timeout=timeout, context=pool.context)
+        self._pool = pool
+
+    def connect(self) -> None:
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=server_hostname,
+            session=self._pool.tls_session(server_hostname),
+        )
+        if self.sock.session_reused:
+            LOGGER.debug("Resumed TLS session with %s", server_hostname)
+        self._pool.save_tls_session(server_hostname, self.sock)
+
+
+class _PooledResponse:
+    """
+    An HTTP response that returns its connection to the HTTPPool once the body
+    has been read to the end.
+    """
+
+    def __init__(
+        self,
+        pool: "HTTPPool",
+        key: "tuple[str, str, int]",
+        conn: http.client.HTTPConnection,
+        resp: http.client.HTTPResponse,
+    ) -> None:
+        self._pool = pool
+        self._key = key
+        self._conn = conn  # type: http.client.HTTPConnection | None
+        self._resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def getheader(self, name: str, default: "str | None" = None) -> "str | None":
+        return self._resp.getheader(name, default)
+
+    def read(self, amt: "int | None" = None) -> bytes:
+        data = self._resp.read(amt)
+        if self._resp.isclosed():
+            self._release()
+        return data
+
+    def close(self) -> None:
+        if not self._resp.isclosed() and self._conn is not None:
+            # The rest of the body is still on the wire. Do not reuse the connection.
+            self._conn.close()
+            self._conn = None
+        self._resp.close()
+        self._release()
+
+    def _release(self) -> None:
+        if self._conn is not None:
+            self._pool.release(self._key, self._conn)
+            self._conn = None
+
+    def __enter__(self) -> "_PooledResponse":
+        return self
+
+    def __exit__(self, *exc: "Any") -> None:
+        self.close()
+
+
+class HTTPPool:
+    """
+    A minimal HTTP client that keeps connections alive between requests.
+
+    Idle connections are kept per scheme, host and port, so that fetching several
+    files from the same server pays for the TCP and TLS handshakes only once.
+    New TLS connections to a host resume the last TLS session with that host.
+    Proxies are taken from the environment, as urllib does.
+    """
+
+    #: The maximum number of idle connections to keep for each host.
+    MAX_IDLE = 8
+    MAX_REDIRECTS = 10
+    USER_AGENT = f"Python-urllib/{sys.version_info[0]}.{sys.version_info[1]}"
+
+    def __init__(self, context: ssl.SSLContext) -> None:
+        self._context = context
+        self._lock = threading.Lock()
+        self._idle = {}  # type: dict[tuple[str, str, int], list[http.client.HTTPConnection]]
+        self._sessions = {}  # type: dict[str, ssl.SSLSession]
+        self._proxies = urllib.request.getproxies()
+
+    @property
+    def context(self) -> ssl.SSLContext:
+        return self._context
+
+    def tls_session(self, hostname: str) -> "ssl.SSLSession | None":
+        with self._lock:
+            return self._sessions.get(hostname)
+
+    def save_tls_session(self, hostname: str, sock: ssl.SSLSocket) -> None:
+        if sock.session is not None:
+            with self._lock:
+                self._sessions[hostname] = sock.session
+
+    def urlopen(
+        self, url: str, headers: "dict[str, str] | None" = None, timeout: float = 30
+    ) -> _PooledResponse:
+        """
+        Send a GET request for 'url', following redirects.
+
+        Like urllib.request.urlopen, raise urllib.error.HTTPError for responses
+        that are not successful.
+        """
+        for _ in range(self.MAX_REDIRECTS + 1):
+            resp = self._request(url, headers or {}, timeout)
+            if 200 <= resp.status < 300:
+                return resp
+            # Read the (small) body, so that the connection can be reused.
+            body = resp.read()
+            resp.close()
+            location = resp.getheader("Location")
+            if resp.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.headers, io.BytesIO(body)
+            )
+        raise RuntimeError(f"Too many redirects for [{url}]")
+
+    def _request(
+        self, url: str, headers: "dict[str, str]", timeout: float
+    ) -> _PooledResponse:
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        headers = dict(headers)
+        headers.setdefault("User-Agent", self.USER_AGENT)
+        proxy = self._proxies.get(scheme)
+        if proxy and not urllib.request.proxy_bypass(parts.hostname):
+            if scheme == "http":
+                # Plain HTTP requests are sent to the proxy with the full URL.
+                # HTTPS requests go through a tunnel, which authenticates with
+                # the proxy itself (see _acquire).
+                target = url
+                headers.update(_proxy_auth_headers(proxy))
+        else:
+            proxy = None
+
+        while True:
+            conn, reused = self._acquire(key, proxy, timeout)
+            try:
+                conn.request("GET", target, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if reused:
+                    # The server closed the idle connection. Try a new one.
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return _PooledResponse(self, key, conn, resp)
+
+    def _acquire(
+        self, key: "tuple[str, str, int]", proxy: "str | None", timeout: float
+    ) -> "tuple[http.client.HTTPConnection, bool]":
+        """
+        Get an idle connection for 'key', or a new one. Also returns whether the
+        connection was reused.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            LOGGER.debug("Reusing connection to %s", key[1])
+            return conn, True
+        scheme, host, port = key
+        conn_host, conn_port = host, port  # type: str, int | None
+        if proxy:
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            conn_host, conn_port = proxy_parts.hostname or "", proxy_parts.port
+        if scheme == "https":
+            conn = _HTTPSConnection(conn_host, conn_port, self, timeout)
+            if proxy:
+                conn.set_tunnel(host, port, headers=_proxy_auth_headers(proxy))
+        else:
+            conn = http.client.HTTPConnection(conn_host, conn_port, timeout=timeout)
+        return conn, False
+
+    def release(
+        self, key: "tuple[str, str, int]", conn: http.client.HTTPConnection
+    ) -> None:
+        """
+        Return a connection whose last response has been read completely.
+        """
+        if conn.sock is None:
+            # The server asked to close the connection.
+            return
+        if isinstance(conn.sock, ssl.SSLSocket):
+            # With TLS 1.3, session tickets arrive after the handshake.
+            self.save_tls_session(key[1], conn.sock)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+def _proxy_auth_headers(proxy: str) -> "dict[str, str]":
+    """
+    Get the headers that authenticate with the given proxy URL, if it has
+    credentials.
+    """
+    parts = urllib.parse.urlsplit(proxy)
+    if not parts.username:
+        return {}
+    creds = urllib.parse.unquote(f"{parts.username}:{parts.password or ''}")
+    auth = base64.b64encode(creds.encode()).decode()
+    return {"Proxy-Authorization": f"Basic {auth}"}
+
+
+#: The connection pool shared by every download of this process.
+HTTP_POOL = HTTPPool(SSL_CONTEXT)
+
+
 class Cache:
     """
     Abstraction over a mongodl downloads cache directory.
     """
 
-    def __init__(self, dirpath: Path, db: CacheDB) -> None:
+    def __init__(
+        self, dirpath: Path, db: CacheDB, segments: int = 1, offline: bool = False
+    ) -> None:
         self._dirpath = dirpath
         self._db = db
+        self._segments = segments
+        self._offline = offline
+        # The URLs that this cache object currently holds a lock for
+        self._locked_urls = set()  # type: set[str]
 
     @staticmethod
     def open_default() -> "Cache":
@@ -579,45 +1104,164 @@ class Cache:
         return Cache.open_in(default_cache_dir())
 
     @staticmethod
-    def open_in(dirpath: Path) -> "Cache":
+    def open_in(dirpath: Path, segments: int = 1, offline: bool = False) -> "Cache":
         """
         Open or create a cache directory at the given path.
+
+        If 'segments' is greater than one, large files are downloaded as that
+        many byte ranges in parallel. If 'offline' is true, only files that are
+        already cached are used, without contacting the server.
         """
         _mkdir(dirpath)
         db = CacheDB.open(dirpath / "data.db")
-        return Cache(dirpath, db)
+        return Cache(dirpath, db, segments, offline)
 
     @property
     def db(self):
         """The backing cache database"""
         return self._db
 
+    @property
+    def dirpath(self) -> Path:
+        """The directory that contains the cache"""
+        return self._dirpath
+
+    @property
+    def segments(self) -> int:
+        """The number of parallel byte ranges used to download large files"""
+        return self._segments
+
+    @property
+    def offline(self) -> bool:
+        """Whether only cached files are used, without contacting the server"""
+        return self._offline
+
+    @contextmanager
+    def lock_url(self, url: str, blocking: bool = True) -> "Iterator[bool]":
+        """
+        Hold an exclusive lock for downloading the given URL, shared with every
+        other process that uses this cache directory.
+
+        Yields whether another holder of the lock had to be waited for. If
+        'blocking' is false and the lock is held elsewhere, raise BlockingIOError.
+        """
+        if url in self._locked_urls:
+            yield False
+            return
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        lock_file = self._dirpath / "locks" / f"{digest}.lock"
+        self._locked_urls.add(url)
+        try:
+            activity = f"download {PurePosixPath(url).name}"
+            with _file_lock(lock_file, activity, blocking) as waited:
+                yield waited
+        finally:
+            self._locked_urls.discard(url)
+
+    def _cached_file_info(self, url: str) -> "tuple[str|None, str|None, str|None]":
+        info = self._db(
+            "SELECT etag, last_modified, sha256 "
+            "FROM mdl_http_downloads WHERE url=:url",
+            url=url,
+        )
+        return next(iter(info), (None, None, None))  # type: ignore
+
     def download_file(self, url: str) -> DownloadResult:
         """
         Obtain a local copy of the file at the given URL.
+
+        The file is first written to a ".partial" file next to the destination,
+        then renamed into place. If a previous attempt was interrupted, the
+        download resumes from where it stopped using a "Range" request.
+
+        The SHA-256 digest of the file is computed while it is downloaded, and
+        is stored in the database so that cache hits do not need to re-read it.
+
+        Only one process downloads a given URL at a time. If another process is
+        already downloading it, this waits for that download and reuses it.
         """
-        info = self._db(
-            "SELECT etag, last_modified " "FROM mdl_http_downloads WHERE url=:url",
+        before = self._cached_file_info(url)
+        with self.lock_url(url) as waited:
+            if waited:
+                info = self._cached_file_info(url)
+                dest = self._file_path(url)
+                if info != before and info[2] is not None and dest.is_file():
+                    LOGGER.info(
+                        "Using file %s downloaded by another process", dest.name
+                    )
+                    self._touch_file(url, dest)
+                    return DownloadResult(False, dest, info[2])
+            if self._offline:
+                return self._offline_file(url)
+            result = self._download_file(url)
+            if not result.is_changed:
+                self._touch_file(url, result.path)
+            return result
+
+    def _offline_file(self, url: str) -> DownloadResult:
+        """
+        Get the cached copy of 'url' without revalidating it with the server.
+        """
+        sha256 = self._cached_file_info(url)[2]
+        dest = self._file_path(url)
+        if sha256 is None or not dest.is_file():
+            raise RuntimeError(f"[{url}] is not cached, and downloads are disabled")
+        LOGGER.info("Using cached file %s without revalidation", dest.name)
+        self._touch_file(url, dest)
+        return DownloadResult(False, dest, sha256)
+
+    def _touch_file(self, url: str, dest: Path) -> None:
+        """
+        Record that the cached copy of 'url' was just used, for eviction by gc().
+        """
+        self._db(
+            "UPDATE mdl_http_downloads SET size=:size, last_access=:now WHERE url=:url",
             url=url,
+            size=dest.stat().st_size,
+            now=time.time(),
         )
-        etag = None  # type: str|None
-        modtime = None  # type: str|None
-        etag, modtime = next(iter(info), (None, None))  # type: ignore
+
+    def _file_path(self, url: str) -> Path:
+        """
+        Get the path of the cached copy of the file at the given URL.
+        """
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:4]
+        return self._dirpath / "files" / digest / PurePosixPath(url).name
+
+    def _download_file(self, url: str, probe: bool = True) -> DownloadResult:
+        etag, modtime, sha256 = self._cached_file_info(url)
         headers = {}  # type: dict[str, str]
         if etag:
             headers["If-None-Match"] = etag
         if modtime:
             headers["If-Modified-Since"] = modtime
-        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:4]
         file_name = PurePosixPath(url).name
-        dest = self._dirpath / "files" / digest / file_name
+        dest = self._file_path(url)
+        partial = dest.with_name(dest.name + ".partial")
         if not dest.exists():
             headers = {}
-        req = urllib.request.Request(url, headers=headers)
-
+        validator = self._partial_validator(url)
+        if validator and partial.is_file():
+            # Resume the previous download, but only if the remote file is unchanged.
+            headers = {
+                "Range": f"bytes={partial.stat().st_size}-",
+                "If-Range": validator,
+            }
+        segmented = probe and self._segments > 1 and "Range" not in headers
+        if segmented:
+            # Only ask for the first byte, to learn the size of the file and
+            # whether ranges are supported without streaming the whole file.
+            headers["Range"] = "bytes=0-0"
         try:
-            resp = urllib.request.urlopen(req, context=SSL_CONTEXT, timeout=30)
+            resp = HTTP_POOL.urlopen(url, headers, timeout=30)
         except urllib.error.HTTPError as e:
+            if e.code == 416 and segmented:
+                # The file is empty.
+                return self._download_file(url, probe=False)
+            if e.code == 416:
+                # The partial file does not fit the remote file. Start over.
+                self._discard_partial(url, partial)
+                return self._download_file(url)
             if e.code != 304:
                 raise RuntimeError(f"Failed to download [{url}]") from e
             assert dest.is_file(), (
@@ -625,40 +1269,357 @@ class Cache:
                 dest,
             )
             LOGGER.info("Using cached file %s", file_name)
-            return DownloadResult(False, dest)
+            self._db(
+                "UPDATE mdl_http_downloads SET validated=:now, max_age=:max_age "
+                "WHERE url=:url",
+                url=url,
+                now=time.time(),
+                max_age=_cache_max_age(e.headers),
+            )
+            if sha256 is None:
+                # The file was cached before digests were recorded.
+                sha256 = _file_sha256(dest)
+                self._db(
+                    "UPDATE mdl_http_downloads SET sha256=:sha256 WHERE url=:url",
+                    url=url,
+                    sha256=sha256,
+                )
+            return DownloadResult(False, dest, sha256)
 
         _mkdir(dest.parent)
-        got_etag = resp.getheader("ETag")
-        got_modtime = resp.getheader("Last-Modified")
-        got_len = int(resp.getheader("Content-Length"))
-        with dest.open("wb") as of:
-            shutil.copyfileobj(resp, of, length=got_len)
-        file_size = dest.stat().st_size
+        with resp:
+            got_etag = resp.getheader("ETag")
+            got_max_age = _cache_max_age(resp.headers)
+            got_modtime = resp.getheader("Last-Modified")
+            got_validator = got_etag or got_modtime
+            if segmented and resp.status == 206:
+                _, got_len = _parse_content_range(resp.getheader("Content-Range"))
+                resp.read()
+                if got_len < SEGMENT_MIN_SIZE:
+                    # Not worth splitting, download it in one request.
+                    return self._download_file(url, probe=False)
+                if got_validator != validator:
+                    # Any partial data belongs to a different version of the file.
+                    self._discard_partial(url, partial)
+                self._db(
+                    "INSERT OR REPLACE INTO mdl_partial_downloads (url, validator) "
+                    "VALUES (:url, :validator)",
+                    url=url,
+                    validator=got_validator,
+                )
+                got_sha256 = _download_segments(
+                    url, partial, got_len, self._segments, got_validator
+                )
+            elif resp.status == 206:
+                start, got_len = _parse_content_range(resp.getheader("Content-Range"))
+                if start != partial.stat().st_size:
+                    # The server did not continue where the partial file ends.
+                    LOGGER.info("Cannot resume download of %s, restarting", file_name)
+                    resp.close()
+                    self._discard_partial(url, partial)
+                    return self._download_file(url)
+                LOGGER.info(
+                    "Resuming download of %s at byte %d",
+                    file_name,
+                    partial.stat().st_size,
+                )
+                # Hash the data we already have, then continue with the rest.
+                hasher = _file_hasher(partial)
+                with partial.open("ab") as of:
+                    _copy_hashed(resp, of, hasher)
+                got_sha256 = hasher.hexdigest()
+            else:
+                got_len = int(resp.getheader("Content-Length"))
+                if got_validator != validator:
+                    # Any partial data belongs to a different version of the file.
+                    self._discard_partial(url, partial)
+                self._db(
+                    "INSERT OR REPLACE INTO mdl_partial_downloads (url, validator) "
+                    "VALUES (:url, :validator)",
+                    url=url,
+                    validator=got_validator,
+                )
+                hasher = hashlib.sha256()
+                with partial.open("wb") as of:
+                    _copy_hashed(resp, of, hasher)
+                got_sha256 = hasher.hexdigest()
+        file_size = partial.stat().st_size
         if file_size != got_len:
+            if file_size > got_len:
+                self._discard_partial(url, partial)
             raise RuntimeError(
                 f"File size: {file_size} does not match download size: {got_len}"
             )
+        os.replace(partial, dest)
+        self._db("DELETE FROM mdl_partial_downloads WHERE url=:url", url=url)
         self._db(
-            "INSERT OR REPLACE INTO mdl_http_downloads (url, etag, last_modified) "
-            "VALUES (:url, :etag, :mtime)",
+            "INSERT OR REPLACE INTO mdl_http_downloads "
+            "(url, etag, last_modified, sha256, size, last_access, validated, max_age) "
+            "VALUES (:url, :etag, :mtime, :sha256, :size, :now, :now, :max_age)",
             url=url,
             etag=got_etag,
             mtime=got_modtime,
+            sha256=got_sha256,
+            size=file_size,
+            now=time.time(),
+            max_age=got_max_age,
         )
-        return DownloadResult(True, dest)
+        return DownloadResult(True, dest, got_sha256)
+
+    def invalidate(self, url: str) -> None:
+        """
+        Forget the cached copy of 'url' so that the next download fetches it again.
+        """
+        self._db("DELETE FROM mdl_http_downloads WHERE url=:url", url=url)
 
-    def refresh_full_json(self) -> None:
+    def _partial_validator(self, url: str) -> "str | None":
+        """
+        Get the ETag or Last-Modified value of an interrupted download of 'url'.
+        """
+        rows = self._db(
+            "SELECT validator FROM mdl_partial_downloads WHERE url=:url", url=url
+        )
+        return next(iter(rows), (None,))[0]
+
+    def _discard_partial(self, url: str, partial: Path) -> None:
+        """
+        Remove the data of an interrupted download of 'url'.
+        """
+        for seg in partial.parent.glob(partial.name + "*"):
+            seg.unlink()
+        self._db("DELETE FROM mdl_partial_downloads WHERE url=:url", url=url)
+
+    def refresh_full_json(
+        self, max_age: "float | None" = None, versions: "Iterable[str]" = ()
+    ) -> None:
         """
         Sync the content of the MongoDB full.json downloads list.
+
+        The server is not asked whether the list changed if it was last checked
+        less than 'max_age' seconds ago, if every one of the given explicit
+        'versions' is already known, or if the cache is offline. By default,
+        'max_age' is default_metadata_ttl(), or else the lifetime that the
+        Cache-Control header of the server gave when the list was last checked,
+        or else DEFAULT_METADATA_TTL.
         """
         default_source = "https://downloads.mongodb.org/full.json"
         download_source = os.environ.get("MONGODB_DOWNLOAD_SOURCE", default_source)
-        with self._db.transaction():
+        versions = [PERF_VERSIONS.get(v, v) for v in versions]
+        if versions and all(self._db.has_version(v) for v in versions):
+            LOGGER.debug("Requested versions are known, not refreshing full.json")
+            return
+        if max_age is None:
+            max_age = default_metadata_ttl()
+        # Hold the lock until the import is done, so other processes do not
+        # query a half-imported list.
+        with self.lock_url(download_source):
+            rows = self._db(
+                "SELECT validated, max_age FROM mdl_http_downloads WHERE url=:url",
+                url=download_source,
+            )
+            validated, server_max_age = next(iter(rows), (None, None))
+            validated = validated or 0
+            if max_age is None:
+                max_age = (
+                    DEFAULT_METADATA_TTL if server_max_age is None else server_max_age
+                )
+            if self._db.schema_is_current() and (
+                self._offline or time.time() - validated < max_age
+            ):
+                LOGGER.debug("Cached %s is fresh", PurePosixPath(download_source).name)
+                return
             dl = self.download_file(download_source)
-            if not dl.is_changed:
+            if not dl.is_changed and self._db.schema_is_current():
                 # We still have a good cache
                 return
-            self._db.import_json_file(dl.path)
+            try:
+                self._db.import_json_file(dl.path)
+            except BaseException:
+                # Make sure the next run imports the file again.
+                self.invalidate(download_source)
+                raise
+
+    def expand_archive(
+        self,
+        dl: DownloadResult,
+        dest: Path,
+        pattern: "str | None",
+        strip_components: int,
+        test: bool,
+    ) -> "ExpandResult":
+        """
+        Expand a downloaded archive into 'dest', reusing a previous extraction of
+        the same archive with the same 'pattern' and 'strip_components'.
+
+        Extracted trees are kept in the "extracted" directory of the cache, keyed
+        by the SHA-256 of the archive and the extraction filters. The files are
+        cloned or copied into 'dest', so the cached tree is not changed through
+        'dest'.
+        """
+        if test or dl.sha256 is None:
+            return _expand_archive(dl.path, dest, pattern, strip_components, test=test)
+        key = hashlib.sha256(
+            f"{dl.sha256}\0{pattern or ''}\0{strip_components}".encode()
+        ).hexdigest()[:32]
+        tree = self._dirpath / "extracted" / key
+        with self._lock_tree(key, f"extract {dl.path.name}"):
+            if not tree.is_dir():
+                # Extract into a private directory first, so that an interrupted
+                # extraction is never mistaken for a complete one.
+                tmp = tree.with_name(f"{key}.tmp-{os.getpid()}-{threading.get_ident()}")
+                shutil.rmtree(tmp, ignore_errors=True)
+                _mkdir(tmp)
+                result = _expand_archive(
+                    dl.path, tmp, pattern, strip_components, test=False
+                )
+                if result is ExpandResult.Empty:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    return result
+                os.rename(tmp, tree)
+                self._db(
+                    "INSERT OR REPLACE INTO mdl_extracted (key, size, last_access) "
+                    "VALUES (:key, :size, :now)",
+                    key=key,
+                    size=_tree_size(tree),
+                    now=time.time(),
+                )
+            else:
+                LOGGER.info("Using cached extraction of %s", dl.path.name)
+                self._db(
+                    "UPDATE mdl_extracted SET last_access=:now WHERE key=:key",
+                    key=key,
+                    now=time.time(),
+                )
+            n_copied = _copy_tree(tree, dest)
+        LOGGER.debug(f"Placed {n_copied} files from [{tree}] into [{dest}]")
+        return ExpandResult.Okay
+
+    @contextmanager
+    def _lock_tree(
+        self, key: str, activity: str, blocking: bool = True
+    ) -> "Iterator[bool]":
+        """
+        Hold an exclusive lock on the extracted tree with the given key.
+        """
+        lock_file = self._dirpath / "locks" / f"extracted-{key}.lock"
+        with _file_lock(lock_file, activity, blocking) as waited:
+            yield waited
+
+    def gc(self, max_size: int, keep_since: float = math.inf) -> int:
+        """
+        Evict the least recently used downloads and extracted trees until the
+        cache holds at most 'max_size' bytes. Returns the number of bytes freed.
+
+        Entries used at or after the 'keep_since' timestamp, and entries that are
+        locked by another process, are never evicted.
+        """
+        # (last_access, size, kind, name)
+        entries = []  # type: list[tuple[float, int, str, str]]
+        downloads = list(
+            self._db("SELECT url, size, last_access FROM mdl_http_downloads")
+        )
+        for url, recorded_size, last_access in downloads:
+            dest = self._file_path(url)
+            if not dest.is_file():
+                self.invalidate(url)
+                continue
+            size = recorded_size or dest.stat().st_size
+            entries.append((last_access or 0, size, "file", url))
+        for (url,) in list(self._db("SELECT url FROM mdl_partial_downloads")):
+            dest = self._file_path(url)
+            parts = list(dest.parent.glob(dest.name + ".partial*"))
+            if parts:
+                size = sum(p.stat().st_size for p in parts)
+                mtime = max(p.stat().st_mtime for p in parts)
+                entries.append((mtime, size, "partial", url))
+        trees = {
+            key: (size, last_access)
+            for key, size, last_access in self._db(
+                "SELECT key, size, last_access FROM mdl_extracted"
+            )
+        }
+        extracted = self._dirpath / "extracted"
+        for tree in extracted.iterdir() if extracted.is_dir() else []:
+            if ".tmp-" in tree.name:
+                continue
+            # Trees created by older versions of mongodl are not recorded.
+            size, last_access = trees.get(tree.name, (None, 0))
+            if size is None:
+                size = _tree_size(tree)
+            entries.append((last_access, size, "tree", tree.name))
+
+        total = sum(e[1] for e in entries)
+        LOGGER.info("Cache holds %d bytes, limit is %d bytes", total, max_size)
+        freed = 0
+        for last_access, size, kind, name in sorted(entries):
+            if total - freed <= max_size:
+                break
+            if last_access >= keep_since:
+                continue
+            try:
+                if kind == "tree":
+                    with self._lock_tree(name, "evict", blocking=False):
+                        shutil.rmtree(extracted / name)
+                        self._db("DELETE FROM mdl_extracted WHERE key=:key", key=name)
+                else:
+                    with self.lock_url(name, blocking=False):
+                        dest = self._file_path(name)
+                        if kind == "file":
+                            self.invalidate(name)
+                            dest.unlink()
+                        else:
+                            self._discard_partial(
+                                name, dest.with_name(dest.name + ".partial")
+                            )
+            except BlockingIOError:
+                LOGGER.debug("Not evicting %s: it is in use", name)
+                continue
+            except FileNotFoundError:
+                pass
+            LOGGER.info("Evicted %s (%d bytes) from the cache", name, size)
+            freed += size
+        return freed
+
+
+def _iter_json_versions(f: "IO[bytes]") -> "Iterator[Any]":
+    """
+    Iterate over the entries of the "versions" array of a full.json file,
+    parsing one entry at a time.
+
+    Uses ijson if it is installed. Otherwise, the entries are decoded one by
+    one from a sliding buffer, which expects the document to start with the
+    "versions" key (as full.json does). Any other layout is loaded whole.
+    """
+    if ijson is not None:
+        yield from ijson.items(f, "versions.item", use_float=True)
+        return
+    decoder = json.JSONDecoder()
+    separators = re.compile(r"[\s,]*")
+    text = io.TextIOWrapper(f, encoding="utf-8")
+    buf = text.read(COPY_BUFSIZE)
+    mat = re.match(r'\s*\{\s*"versions"\s*:\s*\[', buf)
+    if mat is None:
+        text.seek(0)
+        yield from json.load(text)["versions"]
+        return
+    pos = mat.end()
+    while True:
+        pos = separators.match(buf, pos).end()  # type: ignore
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            if pos == len(buf):
+                raise json.JSONDecodeError("Need more data", buf, pos)
+            entry, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The entry continues past the end of the buffer.
+            chunk = text.read(COPY_BUFSIZE)
+            if not chunk:
+                raise
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield entry
 
 
 def _mkdir(dirpath: Path) -> None:
@@ -679,6 +1640,239 @@ def _mkdir(dirpath: Path) -> None:
         pass
 
 
+def _copy_hashed(src: "IO[bytes]", dst: "IO[bytes]", hasher: "Any") -> None:
+    """
+    Copy 'src' into 'dst', feeding every chunk to 'hasher' on the way.
+    """
+    while True:
+        chunk = src.read(COPY_BUFSIZE)
+        if not chunk:
+            return
+        hasher.update(chunk)
+        dst.write(chunk)
+
+
+def _file_hasher(fpath: Path) -> "Any":
+    """
+    Get a SHA-256 hash object that has been fed the content of the given file.
+    """
+    hasher = hashlib.sha256()
+    with fpath.open("rb") as f:
+        while True:
+            chunk = f.read(COPY_BUFSIZE)
+            if not chunk:
+                return hasher
+            hasher.update(chunk)
+
+
+def _file_sha256(fpath: Path) -> str:
+    """
+    Get the SHA-256 digest of the given file.
+    """
+    return _file_hasher(fpath).hexdigest()
+
+
+@contextmanager
+def _file_lock(path: Path, activity: str, blocking: bool = True) -> "Iterator[bool]":
+    """
+    Hold an exclusive advisory lock on the file at 'path' (which is created if
+    needed). Yields whether the lock was held by someone else at first.
+
+    If 'blocking' is false, raise BlockingIOError instead of waiting for the
+    lock to be released.
+    """
+    _mkdir(path.parent)
+    with path.open("a+b") as f:
+        waited = False
+        if sys.platform == "win32":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError as e:
+                    if not blocking:
+                        raise BlockingIOError(f"{path} is locked") from e
+                    if not waited:
+                        LOGGER.info("Waiting for another process to %s", activity)
+                    waited = True
+                    time.sleep(0.1)
+            try:
+                yield waited
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking:
+                    raise
+                LOGGER.info("Waiting for another process to %s", activity)
+                waited = True
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield waited
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _cache_max_age(headers: "http.client.HTTPMessage") -> "float | None":
+    """
+    Get the freshness lifetime (in seconds) that the Cache-Control header of a
+    response allows, or None if it does not give one.
+    """
+    max_age = None
+    for directive in (headers.get("Cache-Control") or "").split(","):
+        name, _, value = directive.strip().partition("=")
+        name = name.lower()
+        if name in ("no-cache", "no-store"):
+            return 0
+        if name == "max-age":
+            try:
+                max_age = max(float(value.strip('"')), 0)
+            except ValueError:
+                pass
+    return max_age
+
+
+def _parse_content_range(content_range: "str | None") -> "tuple[int, int]":
+    """
+    Get the start of the range and the total file size from a
+    "Content-Range: bytes <start>-<end>/<size>" header.
+    """
+    mat = re.match(r"bytes (\d+)-\d+/(\d+)$", content_range or "")
+    if mat is None:
+        raise RuntimeError(f"Unexpected Content-Range: {content_range}")
+    return int(mat.group(1)), int(mat.group(2))
+
+
+def _download_segments(
+    url: str, partial: Path, length: int, segments: int, validator: "str | None"
+) -> str:
+    """
+    Download the file at 'url' into 'partial' as several byte ranges in parallel.
+
+    Each range is written to its own "<partial>.<n>" file so that it can be
+    resumed independently, then the ranges are joined in order. Returns the
+    SHA-256 digest of the joined file.
+    """
+    seg_size = -(-length // segments)
+    bounds = [
+        (start, min(start + seg_size, length) - 1)
+        for start in range(0, length, seg_size)
+    ]
+    seg_files = [
+        partial.with_name(f"{partial.name}.{idx}") for idx in range(len(bounds))
+    ]
+
+    def _fetch(seg_file: Path, start: int, end: int) -> None:
+        have = seg_file.stat().st_size if seg_file.is_file() else 0
+        if have > end - start + 1:
+            seg_file.unlink()
+            have = 0
+        if have == end - start + 1:
+            return
+        headers = {"Range": f"bytes={start + have}-{end}"}
+        if validator:
+            headers["If-Range"] = validator
+        with HTTP_POOL.urlopen(url, headers, timeout=30) as resp:
+            if resp.status != 206:
+                raise RuntimeError(f"Server did not honor the byte range for [{url}]")
+            with seg_file.open("ab") as of:
+                shutil.copyfileobj(resp, of, COPY_BUFSIZE)
+        # A dropped connection can end the response early without an error.
+        got = seg_file.stat().st_size
+        if got != end - start + 1:
+            raise RuntimeError(
+                f"Segment size: {got} does not match range size: {end - start + 1}"
+            )
+
+    LOGGER.info("Downloading %s in %d segments", partial.name, len(bounds))
+    with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+        futures = [
+            pool.submit(_fetch, seg_file, start, end)
+            for seg_file, (start, end) in zip(seg_files, bounds)
+        ]
+        for fut in futures:
+            fut.result()
+    hasher = hashlib.sha256()
+    with partial.open("wb") as of:
+        for seg_file in seg_files:
+            with seg_file.open("rb") as infile:
+                _copy_hashed(infile, of, hasher)
+    for seg_file in seg_files:
+        seg_file.unlink()
+    return hasher.hexdigest()
+
+
+def _tree_size(path: Path) -> int:
+    """
+    Get the total size of the files in the given directory tree.
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fname in filenames:
+            total += os.lstat(os.path.join(dirpath, fname)).st_size
+    return total
+
+
+def _copy_tree(src: Path, dest: Path) -> int:
+    """
+    Re-create the directory tree 'src' in 'dest'. Files are cloned where the
+    file system supports it, and copied otherwise, but never hard-linked, so
+    that changing them in 'dest' never changes 'src'. Symbolic links are
+    re-created as symbolic links.
+
+    :return: The number of files and links placed in 'dest'.
+    """
+    n_files = 0
+    clone = sys.platform.startswith("linux")
+    for root, dirs, files in os.walk(src):
+        out_dir = dest / Path(root).relative_to(src)
+        _mkdir(out_dir)
+        # os.walk() lists links to directories in 'dirs', but does not follow them.
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = out_dir / name
+            is_link = os.path.islink(source)
+            if name in dirs and not is_link:
+                _mkdir(target)
+                continue
+            if target.is_symlink() or target.exists():
+                target.unlink()
+            if is_link:
+                os.symlink(os.readlink(source), target)
+            elif clone:
+                try:
+                    _clone_file(source, target)
+                except OSError as e:
+                    # Do not try again for every file of the tree.
+                    LOGGER.debug(f"Cannot clone files into [{dest}], copying: {e}")
+                    clone = False
+                    shutil.copy2(source, target)
+            else:
+                shutil.copy2(source, target)
+            n_files += 1
+    return n_files
+
+
+def _clone_file(src: str, dest: Path) -> None:
+    """
+    Create 'dest' as a copy-on-write clone of the file 'src', with the same
+    metadata. Raises OSError, without leaving 'dest' behind, if the file
+    system does not support clones.
+    """
+    with open(src, "rb") as in_file, dest.open("wb") as out_file:
+        try:
+            fcntl.ioctl(out_file.fileno(), FICLONE, in_file.fileno())
+        except OSError:
+            out_file.close()
+            dest.unlink()
+            raise
+    shutil.copystat(src, dest)
+
+
 def _print_list(
     db: CacheDB,
     version: "str | None",
@@ -723,8 +1917,8 @@ def _print_list(
             (select group_concat(target, ', ') from (select distinct target from mdl_downloads)),
             (select group_concat(edition, ', ') from (select distinct edition from mdl_downloads)),
             (select group_concat(version, ', ') from (
-                select distinct version from mdl_versions
-                ORDER BY version COLLATE mdb_version)),
+                select version from mdl_versions
+                GROUP BY version ORDER BY min(sort_key))),
             (select group_concat(key, ', ') from (select distinct key from mdl_components))
         )
         """)
@@ -781,7 +1975,12 @@ def _published_build_url(
         component = "archive"
         value = "debug_symbols"
     matching = cache.db.iter_available(
-        version=version, target=target, arch=arch, edition=edition, component=component
+        version=version,
+        target=target,
+        arch=arch,
+        edition=edition,
+        component=component,
+        limit=1,
     )
     tup = next(iter(matching), None)
     if tup is None:
@@ -862,6 +2061,28 @@ def _dl_component(
     latest_build_branch: "str|None",
     retries: int,
 ) -> ExpandResult:
+    dl_url, sha256 = _resolve_component_url(
+        cache, version, target, arch, edition, component, latest_build_branch
+    )
+    if no_download:
+        return None
+    return _fetch_and_expand(
+        cache, dl_url, sha256, out_dir, pattern, strip_components, test, retries
+    )
+
+
+def _resolve_component_url(
+    cache: Cache,
+    version: str,
+    target: str,
+    arch: str,
+    edition: str,
+    component: str,
+    latest_build_branch: "str|None",
+) -> "tuple[str, str | None]":
+    """
+    Get the download URL and the expected SHA-256 (if published) of a component.
+    """
     LOGGER.info(f"Download {component} {version}-{edition} for {target}-{arch}")
     if version in ("latest-build", "latest"):
         dl_url = _latest_build_url(
@@ -893,41 +2114,153 @@ def _dl_component(
     print(dl_url)
 
     LOGGER.info("Download url: %s", dl_url)
+    return dl_url, sha256
 
-    if no_download:
-        return None
 
+def _fetch_and_expand(
+    cache: Cache,
+    dl_url: str,
+    sha256: "str | None",
+    out_dir: Path,
+    pattern: "str | None",
+    strip_components: int,
+    test: bool,
+    retries: int,
+    on_stage: "Callable[[str, float, float], None] | None" = None,
+) -> ExpandResult:
+    """
+    Download the file at the given URL into the cache and expand it into 'out_dir'.
+
+    If given, 'on_stage' is called with "download" or "extract" and the start
+    and end times of that stage, as returned by time.time().
+    """
     retrier = DownloadRetrier(retries)
     while True:
         try:
-            cached = cache.download_file(dl_url).path
-            if sha256 is not None and not _check_shasum256(cached, sha256):
+            start = time.time()
+            dl = cache.download_file(dl_url)
+            cached = dl.path
+            if sha256 is not None and dl.sha256 != sha256:
+                # Do not trust the cached copy on the next attempt.
+                cache.invalidate(dl_url)
                 raise ValueError("Incorrect shasum256 for %s", cached)
-            return _expand_archive(
-                cached, out_dir, pattern, strip_components, test=test
+            if on_stage is not None:
+                on_stage("download", start, time.time())
+            start = time.time()
+            result = cache.expand_archive(
+                dl, out_dir, pattern, strip_components, test=test
             )
+            if on_stage is not None:
+                on_stage("extract", start, time.time())
+            return result
         except Exception as e:
             LOGGER.exception(e)
             if not retrier.retry():
                 raise
 
 
-def _check_shasum256(filename, shasum):
-    """Check if the file with the name "filename" matches the SHA-256 sum
-    in "shasum"."""
-    h = hashlib.sha256()
-    # This will raise an exception if the file doesn't exist. Catching
-    # and handling it is left as an exercise for the reader.
-    with open(filename, "rb") as fh:
-        # Read and hash the file in 4K chunks. Reading the whole
-        # file at once might consume a lot of memory if it is
-        # large.
-        while True:
-            data = fh.read(4096)
-            if len(data) == 0:
-                break
-            h.update(data)
-    return shasum == h.hexdigest()
+def download_components(
+    cache: Cache,
+    specs: "Iterable[ComponentSpec]",
+    *,
+    test: bool = False,
+    no_download: bool = False,
+    retries: int = 0,
+    jobs: "int | None" = None,
+    on_stage: "Callable[[str, str, float, float], None] | None" = None,
+) -> "list[ExpandResult]":
+    """
+    Download and extract several components in one pass.
+
+    The download URL of every component is resolved up front using the current
+    content of the cache database, then the components are downloaded and
+    extracted concurrently using at most 'jobs' threads. The results are
+    returned in the same order as 'specs'.
+
+    If given, 'on_stage' is called with the component name, the stage
+    ("download" or "extract") and its start and end times (from time.time())
+    whenever a component finishes a stage. It may be called from any thread.
+    """
+    specs = list(specs)
+    urls = []
+    for spec in specs:
+        version = PERF_VERSIONS.get(spec.version, spec.version)
+        target = spec.target or infer_target(version)
+        arch = spec.arch or infer_arch()
+        urls.append(
+            _resolve_component_url(
+                cache,
+                version,
+                target,
+                arch,
+                spec.edition,
+                spec.component,
+                spec.latest_build_branch,
+            )
+        )
+    if no_download or not specs:
+        return [None] * len(specs)
+
+    def _fetch(spec: ComponentSpec, dl_url: str, sha256: "str | None"):
+        # SQLite connections cannot be shared between threads, so each worker
+        # uses its own handle to the same cache directory.
+        worker_cache = Cache.open_in(cache.dirpath, cache.segments, cache.offline)
+        return _fetch_and_expand(
+            worker_cache,
+            dl_url,
+            sha256,
+            Path(spec.out).absolute(),
+            spec.pattern,
+            spec.strip_components,
+            test,
+            retries,
+            None if on_stage is None else functools.partial(on_stage, spec.component),
+        )
+
+    jobs = min(jobs or DEFAULT_JOBS, len(specs))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(_fetch, spec, dl_url, sha256)
+            for spec, (dl_url, sha256) in zip(specs, urls)
+        ]
+        return [fut.result() for fut in futures]
+
+
+def _load_batch_specs(
+    batch_file: Path, args: argparse.Namespace
+) -> "list[ComponentSpec]":
+    """
+    Load the component specs from a JSON batch file, using the command line
+    arguments as the default for any omitted field.
+    """
+    if str(batch_file) == "-":
+        items = json.load(sys.stdin)
+    else:
+        with batch_file.open("r", encoding="utf-8") as f:
+            items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError(f"Expected a list of components in [{batch_file}]")
+    defaults = dict(
+        component=args.component,
+        version=args.version,
+        out=args.out or Path.cwd(),
+        pattern=args.only,
+        strip_components=args.strip_components,
+        edition=args.edition,
+        target=None if args.target == "auto" else args.target,
+        arch=None if args.arch == "auto" else args.arch,
+        latest_build_branch=args.latest_build_branch,
+    )
+    specs = []
+    for item in items:
+        unknown = set(item) - set(ComponentSpec._fields)
+        if unknown:
+            raise ValueError(f"Unknown component fields: {', '.join(sorted(unknown))}")
+        fields = {**defaults, **item}
+        fields["out"] = Path(fields["out"])
+        fields["strip_components"] = int(fields["strip_components"])
+        specs.append(ComponentSpec(**fields))
+    return specs
 
 
 def _pathjoin(items: "Iterable[str]") -> PurePath:
@@ -937,36 +2270,75 @@ def _pathjoin(items: "Iterable[str]") -> PurePath:
     return PurePath("/".join(items))
 
 
-def _test_pattern(path: PurePath, pattern: "PurePath | None") -> bool:
+def _glob_part_regex(part: str) -> str:
+    """
+    Translate one path component of a globbing pattern into a regular expression
+    that never matches a "/".
     """
-    Test whether the given 'path' string matches the globbing pattern 'pattern'.
+    if part == "**":
+        # Any number of intermediate directories
+        return "(?:/[^/]+)*"
+    res = ["/"]
+    i, n = 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and part[j] == "!":
+                j += 1
+            if j < n and part[j] == "]":
+                j += 1
+            while j < n and part[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+                continue
+            stuff = part[i:j].replace("\\", "\\\\")
+            i = j + 1
+            if stuff.startswith("!"):
+                stuff = "^" + stuff[1:] + "/"
+            elif stuff.startswith("^"):
+                stuff = "\\" + stuff
+            res.append(f"[{stuff}]")
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
+
 
-    Supports the '**' pattern to match any number of intermediate directories.
+def _compile_pattern(pattern: "str | None") -> "re.Pattern[str] | None":
     """
-    if pattern is None:
-        return True
-    # Split pattern into parts
-    pattern_parts = pattern.parts
-    if not pattern_parts:
+    Compile the globbing pattern 'pattern' into a regular expression that is
+    matched against an archive member path of the form "/<part>/<part>...".
+
+    A pattern matches a path if it matches the leading components of the path,
+    so a pattern that names a directory matches everything within it. Supports
+    the '**' pattern to match any number of intermediate directories.
+    """
+    if not pattern:
+        return None
+    parts = PurePath(pattern).parts
+    if not parts:
         # An empty pattern always matches
-        return True
-    path_parts = path.parts
-    if not path_parts:
-        # Non-empty pattern requires more path components
-        return False
-    pattern_head = pattern_parts[0]
-    pattern_tail = _pathjoin(pattern_parts[1:])
-    if pattern_head == "**":
-        # Special "**" pattern matches any suffix of the path
-        # Generate each suffix:
-        tails = (path_parts[i:] for i in range(len(path_parts)))
-        # Test if any of the suffixes match the remainder of the pattern:
-        return any(_test_pattern(_pathjoin(t), pattern_tail) for t in tails)
-    if not fnmatch(path.parts[0], pattern_head):
-        # Leading path component cannot match
-        return False
-    # The first component matches. Test the remainder:
-    return _test_pattern(_pathjoin(path_parts[1:]), pattern_tail)
+        return None
+    body = "".join(_glob_part_regex(part) for part in parts)
+    # A trailing "**" must match at least one more path component.
+    tail = "/.+" if parts[-1] == "**" else "(?:/.*)?"
+    flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+    return re.compile(body + tail, flags | re.DOTALL)
+
+
+def _pattern_literal_parts(pattern: "str | None") -> "tuple[str, ...] | None":
+    """
+    If 'pattern' contains no globbing characters, get its path components.
+    """
+    if not pattern or any(c in pattern for c in "*?["):
+        return None
+    return PurePath(pattern).parts or None
 
 
 def _expand_archive(
@@ -1011,37 +2383,171 @@ def _expand_archive(
     return ExpandResult.Okay
 
 
+class _LinkTargetMissing(Exception):
+    """
+    A hard link member of a streamed archive links to a member that was not
+    extracted, so its content can not be read anymore.
+    """
+
+
 def _expand_tgz(
     ar: Path, dest: Path, pattern: "str | None", strip_components: int, test: bool
 ) -> int:
     "Expand a tar.gz archive"
-    n_extracted = 0
-    with tarfile.open(str(ar), "r:*") as tf:
-        for mem in tf.getmembers():
-            n_extracted += _maybe_extract_member(
-                dest,
-                PurePath(mem.name),
-                pattern,
-                strip_components,
-                mem.isdir(),
-                lambda: cast("IO[bytes]", tf.extractfile(mem)),  # noqa: B023
-                mem.mode | 0o222,  # make sure file is writable
-                test=test,
+    matcher = _compile_pattern(pattern)
+    literal = _pattern_literal_parts(pattern)
+    # Read the archive as a stream, so members are visited in a single pass and
+    # reading can stop as soon as nothing else can match.
+    try:
+        with _open_tgz(ar) as stream, tarfile.open(fileobj=stream, mode="r|") as tf:
+            return _expand_tar(
+                tf, dest, matcher, literal, strip_components, test, stream=True
             )
+    except _LinkTargetMissing as err:
+        LOGGER.debug(f"Re-reading [{ar.name}] to extract the hard link to [{err}]")
+    with tarfile.open(str(ar), "r:*") as tf:
+        return _expand_tar(
+            tf, dest, matcher, literal, strip_components, test, stream=False
+        )
+
+
+def _expand_tar(
+    tf: tarfile.TarFile,
+    dest: Path,
+    matcher: "re.Pattern[str] | None",
+    literal: "tuple[str, ...] | None",
+    strip_components: int,
+    test: bool,
+    stream: bool,
+) -> int:
+    """
+    Expand the members of an opened tar archive. If 'stream' is true, the
+    archive was opened as a stream and can only be read forward.
+
+    If the pattern has no globbing characters ('literal'), reading stops after
+    the file it names, or after the last member of the directory it names.
+    Other patterns, and extraction without a pattern, read every member.
+    """
+    n_extracted = 0
+    # The destination of every regular file extracted so far, by member path.
+    extracted: dict[PurePath, Path] = {}
+    # Whether the previous member was within the path named by the pattern.
+    in_literal = False
+    for mem in tf:
+        relpath = PurePath(mem.name)
+        if literal is not None:
+            # Archives store the content of a directory together, so the first
+            # member after it means that nothing else can match.
+            within = relpath.parts[: len(literal)] == literal
+            if in_literal and not within:
+                LOGGER.debug(" (Left the only directory that matches the pattern)")
+                break
+            in_literal = within
+
+        def opener(mem: tarfile.TarInfo = mem) -> "IO[bytes]":
+            if not (mem.islnk() and stream):
+                return cast("IO[bytes]", tf.extractfile(mem))
+            # A stream can not go back to the member that is linked to, so copy
+            # the file that was extracted from it instead.
+            target = extracted.get(PurePath(mem.linkname))
+            if target is None:
+                raise _LinkTargetMissing(mem.linkname)
+            return target.open("rb")
+
+        n = _maybe_extract_member(
+            dest,
+            relpath,
+            matcher,
+            strip_components,
+            mem.isdir(),
+            opener,
+            mem.mode | 0o222,  # make sure file is writable
+            test=test,
+            symlink=mem.linkname if mem.issym() else None,
+        )
+        n_extracted += n
+        if n and (mem.isfile() or mem.islnk()):
+            extracted[relpath] = dest / _pathjoin(relpath.parts[strip_components:])
+        if literal is not None and mem.isfile() and relpath.parts == literal:
+            # The pattern names this exact file, nothing else can match.
+            LOGGER.debug(" (Found the only file that matches the pattern)")
+            break
     return n_extracted
 
 
+def _pick_decompressor() -> str:
+    """
+    Choose the decompression backend for .tgz archives.
+    """
+    available = {
+        "isal": isal_gzip is not None,
+        "zlib-ng": zlib_ng_gzip is not None,
+        "pigz": shutil.which("pigz") is not None,
+        "gzip": shutil.which("gzip") is not None,
+        "python": True,
+    }
+    wanted = os.environ.get("MONGODL_DECOMPRESSOR", "auto")
+    if wanted == "auto":
+        # Plain "gzip" is only used when asked for.
+        return next(
+            name for name in DECOMPRESSORS if name != "gzip" and available[name]
+        )
+    if wanted not in available:
+        raise ValueError(
+            f"Unknown MONGODL_DECOMPRESSOR {wanted!r}, "
+            f"expected 'auto' or one of: {', '.join(DECOMPRESSORS)}"
+        )
+    if not available[wanted]:
+        LOGGER.warning(f"The {wanted} decompressor is not available, using python")
+        return "python"
+    return wanted
+
+
+@contextmanager
+def _open_tgz(ar: Path) -> "Iterator[IO[bytes]]":
+    """
+    Open a stream of the decompressed content of a .tgz archive.
+    """
+    backend = _pick_decompressor()
+    LOGGER.info(f"Decompressing {ar.name} using {backend}")
+    if backend == "isal":
+        with isal_gzip.open(str(ar), "rb") as f:
+            yield f
+    elif backend == "zlib-ng":
+        with zlib_ng_gzip.open(str(ar), "rb") as f:
+            yield f
+    elif backend in ("pigz", "gzip"):
+        # Decompress in a separate process, so it runs on another core while
+        # the members are written out.
+        proc = subprocess.Popen(
+            [cast(str, shutil.which(backend)), "-dc", str(ar)], stdout=subprocess.PIPE
+        )
+        try:
+            yield cast("IO[bytes]", proc.stdout)
+        finally:
+            # If we stopped reading early, closing the pipe ends the process.
+            cast("IO[bytes]", proc.stdout).close()
+            returncode = proc.wait()
+        sigpipe = getattr(signal, "SIGPIPE", None)
+        if returncode != 0 and (sigpipe is None or returncode != -sigpipe):
+            raise RuntimeError(f"{backend} failed to decompress [{ar}]: {returncode}")
+    else:
+        with gzip.open(str(ar), "rb") as f:
+            yield f
+
+
 def _expand_zip(
     ar: Path, dest: Path, pattern: "str | None", strip_components: int, test: bool
 ) -> int:
     "Expand a .zip archive."
     n_extracted = 0
+    matcher = _compile_pattern(pattern)
     with zipfile.ZipFile(str(ar), "r") as zf:
         for item in zf.infolist():
             n_extracted += _maybe_extract_member(
                 dest,
                 PurePath(item.filename),
-                pattern,
+                matcher,
                 strip_components,
                 item.filename.endswith("/"),  ## Equivalent to: item.is_dir(),
                 lambda: zf.open(item, "r"),  # noqa: B023
@@ -1054,15 +2560,17 @@ def _expand_zip(
 def _maybe_extract_member(
     out: Path,
     relpath: PurePath,
-    pattern: "str | None",
+    matcher: "re.Pattern[str] | None",
     strip: int,
     is_dir: bool,
     opener: "Callable[[], IO[bytes]]",
     modebits: int,
     test: bool,
+    symlink: "str | None" = None,
 ) -> int:
     """
-    Try to extract an archive member according to the given arguments.
+    Try to extract an archive member according to the given arguments. If
+    'symlink' is given, the member is a symbolic link to that path.
 
     :return: Zero if the file was excluded by filters, one otherwise.
     """
@@ -1072,7 +2580,9 @@ def _maybe_extract_member(
         # Not enough path components
         LOGGER.debug(" (Excluded by --strip-components)")
         return 0
-    if not _test_pattern(relpath, PurePath(pattern) if pattern else None):
+    if matcher is not None and not matcher.fullmatch(
+        "".join("/" + part for part in relpath.parts)
+    ):
         # Doesn't match our pattern
         LOGGER.debug(" (excluded by pattern)")
         return 0
@@ -1085,6 +2595,17 @@ def _maybe_extract_member(
     if is_dir:
         _mkdir(dest)
         return 1
+    if symlink is not None:
+        root = os.path.abspath(out)
+        linked = os.path.abspath(os.path.join(dest.parent, symlink))
+        if os.path.isabs(symlink) or os.path.commonpath([linked, root]) != root:
+            LOGGER.warning(f"Skipping [{relpath}]: links outside of the destination")
+            return 0
+        _mkdir(dest.parent)
+        if dest.is_symlink() or dest.exists():
+            dest.unlink()
+        os.symlink(symlink, dest)
+        return 1
     with opener() as infile:
         _mkdir(dest.parent)
         with dest.open("wb") as outfile:
@@ -1209,9 +2730,90 @@ def main(argv=None):
         metavar="BRANCH_NAME",
     )
     dl_grp.add_argument("--retries", help="The number of times to retry", default=0)
+    dl_grp.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Download large files as N byte ranges in parallel, if the server "
+        "supports range requests (Default is 1)",
+    )
+    batch_grp = parser.add_argument_group(
+        "Batch arguments",
+        description="Download and extract several components at once. "
+        "The download arguments above are used as defaults for each component.",
+    )
+    batch_grp.add_argument(
+        "--batch",
+        type=Path,
+        metavar="FILE",
+        help="A JSON file (or '-' for stdin) that contains a list of components "
+        'to download, e.g. [{"component": "archive", "out": "bin", '
+        '"strip_components": 2}]. Valid fields are: '
+        + ", ".join(ComponentSpec._fields),
+    )
+    batch_grp.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="The maximum number of components to download and extract "
+        f"concurrently (Default is {DEFAULT_JOBS})",
+    )
+    cache_grp = parser.add_argument_group(
+        "Cache arguments",
+        description="Control how the download cache is used and how much disk "
+        "space it takes. The least recently used downloads and extracted archives "
+        "are evicted first.",
+    )
+    cache_grp.add_argument(
+        "--cache-max-size",
+        type=parse_size,
+        default=default_cache_max_size(),
+        metavar="SIZE",
+        help='The size budget of the cache, e.g. "10G". After downloading, '
+        "evict old entries until the cache fits. (Default is the value of "
+        "MONGODL_CACHE_MAX_SIZE, or no limit)",
+    )
+    cache_grp.add_argument(
+        "--gc",
+        action="store_true",
+        help="Only evict entries from the cache until it fits --cache-max-size, "
+        "then exit.",
+    )
+    cache_grp.add_argument(
+        "--metadata-ttl",
+        type=float,
+        default=default_metadata_ttl(),
+        metavar="SECONDS",
+        help="Do not check whether the downloads list changed on the server if it "
+        "was last checked less than this many seconds ago. Explicit versions that "
+        "are already known never cause a check. (Default is the value of "
+        "MONGODL_METADATA_TTL, or the max-age that the server sent with the list "
+        f"and that is stored in the cache, or {DEFAULT_METADATA_TTL})",
+    )
+    cache_grp.add_argument(
+        "--offline",
+        action="store_true",
+        default=default_offline(),
+        help="Only use the cached downloads list and files, and never contact the "
+        "server. (Default is true if MONGODL_OFFLINE is set)",
+    )
     args = parser.parse_args(argv)
-    cache = Cache.open_in(args.cache_dir)
-    cache.refresh_full_json()
+    if args.verbose:
+        LOGGER.setLevel(logging.DEBUG)
+    elif args.quiet:
+        LOGGER.setLevel(logging.WARNING)
+
+    cache = Cache.open_in(args.cache_dir, args.segments, args.offline)
+    if args.gc:
+        if args.cache_max_size is None:
+            parser.error("--gc requires --cache-max-size or MONGODL_CACHE_MAX_SIZE")
+        cache.gc(args.cache_max_size)
+        return
+
+    # Never evict what this run downloads or extracts.
+    started = time.time()
 
     version = args.version
     if version in PERF_VERSIONS:
@@ -1223,15 +2825,29 @@ def main(argv=None):
     if arch == "auto":
         arch = infer_arch()
 
-    if args.verbose:
-        LOGGER.setLevel(logging.DEBUG)
-    elif args.quiet:
-        LOGGER.setLevel(logging.WARNING)
-
     if args.list:
+        cache.refresh_full_json(args.metadata_ttl)
         _print_list(cache.db, version, target, arch, args.edition, args.component)
         return
 
+    if args.batch:
+        specs = _load_batch_specs(args.batch, args)
+        cache.refresh_full_json(args.metadata_ttl, [spec.version for spec in specs])
+        results = download_components(
+            cache,
+            specs,
+            test=args.test,
+            no_download=args.no_download,
+            retries=int(args.retries),
+            jobs=args.jobs,
+        )
+        if args.cache_max_size is not None:
+            cache.gc(args.cache_max_size, keep_since=started)
+        if ExpandResult.Empty in results and args.empty_is_error:
+            sys.exit(1)
+        return
+
+    cache.refresh_full_json(args.metadata_ttl, [version])
     out = args.out or Path.cwd()
     out = out.absolute()
 
@@ -1250,6 +2866,8 @@ def main(argv=None):
         latest_build_branch=args.latest_build_branch,
         retries=int(args.retries),
     )
+    if args.cache_max_size is not None:
+        cache.gc(args.cache_max_size, keep_since=started)
     if result is ExpandResult.Empty and args.empty_is_error:
         sys.exit(1)
 
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Benchmark the mongodl download and extraction pipeline against a local server.
+
+A synthetic full.json and synthetic .tgz/.zip archives are generated in a work
+directory and served over HTTP on localhost. MONGODB_DOWNLOAD_SOURCE points
+mongodl at the local full.json, and the download URLs in that file point at the
+local archives, so no request leaves the machine.
+
+Each stage of the pipeline is timed separately over several iterations, each
+with an empty cache, and the results are written as JSON. Use '--baseline' to
+compare against the results of a previous run and fail on regressions.
+
+Use '--help' for more information.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+
+HERE = Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+from mongodl import LOGGER as DL_LOGGER
+from mongodl import (
+    Cache,
+    _pick_decompressor,
+    _resolve_component_url,
+)
+
+#: The stages of the pipeline, in the order they run.
+STAGES = (
+    "refresh",
+    "import",
+    "revalidate",
+    "resolve",
+    "download",
+    "extract",
+    "extract_cached",
+)
+
+#: (target, arch, edition) of the downloads listed for every version. Only the
+#: first two have archives, the others only make full.json realistically large.
+PLATFORMS = [
+    ("ubuntu2204", "x86_64", "enterprise"),
+    ("windows", "x86_64", "enterprise"),
+] + [
+    (target, arch, edition)
+    for target in ("ubuntu2004", "rhel80", "rhel90", "debian12", "amazon2023")
+    for arch in ("x86_64", "aarch64")
+    for edition in ("enterprise", "targeted")
+]
+
+#: Stages that take less than this (in seconds) are never reported as
+#: regressions, since their timings are mostly noise.
+MIN_REGRESSION_TIME = 0.005
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the files of the work directory with ETag, conditional and range
+    request support, like the real download servers.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        path = self.server.root / self.path.lstrip("/")  # type: ignore
+        if not path.is_file():
+            self.send_error(404)
+            return
+        data = path.read_bytes()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = 0, len(data) - 1
+        mat = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if mat and (if_range is None or if_range == etag):
+            start = int(mat.group(1))
+            end = min(int(mat.group(2) or end), end)
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self._send(memoryview(data)[start : end + 1])
+
+    def _send(self, data: memoryview) -> None:
+        bandwidth = self.server.bandwidth  # type: ignore
+        if not bandwidth:
+            self.wfile.write(data)
+            return
+        # Throttle to the requested number of bytes per second.
+        chunk = max(bandwidth // 100, 1)
+        for pos in range(0, len(data), chunk):
+            self.wfile.write(data[pos : pos + chunk])
+            time.sleep(chunk / bandwidth)
+
+
+@contextlib.contextmanager
+def _serve(root: Path, bandwidth: int):
+    """
+    Serve 'root' on an ephemeral localhost port. Yields the base URL.
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.root = root  # type: ignore
+    server.bandwidth = bandwidth  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _payload(rng: random.Random, size: int) -> bytes:
+    """
+    Generate 'size' bytes that compress about as well as MongoDB binaries.
+    """
+
+    # A third of random data, the rest repeats blocks that are close enough
+    # to each other for gzip to find them.
+    def random_block() -> bytes:
+        return rng.getrandbits(4096 * 8).to_bytes(4096, "little")
+
+    pool = [random_block() for _ in range(4)]
+    blocks = []
+    for idx in range(-(-size // 4096)):
+        blocks.append(random_block() if idx % 3 == 0 else rng.choice(pool))
+    return b"".join(blocks)[:size]
+
+
+def _archive_members(
+    rng: random.Random, root: str, size: int, n_files: int
+) -> "dict[str, bytes]":
+    """
+    Get the members of a synthetic server archive of about 'size' bytes, with a
+    few large binaries and 'n_files' small files.
+    """
+    small = 4096
+    big = max(size - n_files * small, 0) // 3
+    members = {
+        f"{root}/bin/{name}": _payload(rng, big)
+        for name in ("mongod", "mongos", "mongo")
+    }
+    for idx in range(n_files):
+        members[f"{root}/share/doc/file{idx}.txt"] = _payload(rng, small)
+    members[f"{root}/LICENSE-Community.txt"] = b"license\n"
+    return members
+
+
+def _write_tgz(path: Path, members: "dict[str, bytes]") -> None:
+    with tarfile.open(path, "w:gz") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755
+            tf.addfile(info, io.BytesIO(data))
+
+
+def _write_zip(path: Path, members: "dict[str, bytes]") -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def generate(root: Path, base_url: str, args: argparse.Namespace) -> str:
+    """
+    Generate the synthetic full.json and archives in 'root'. Returns the version
+    that has downloadable archives.
+    """
+    rng = random.Random(args.seed)
+    size = args.archive_size * 1024 * 1024
+    versions = [
+        f"{4 + idx // 100}.{(idx // 10) % 10}.{idx % 10}"
+        for idx in range(args.versions)
+    ]
+    bench_version = versions[-1]
+    entries = []
+    for version in reversed(versions):
+        downloads = []
+        for target, arch, edition in PLATFORMS:
+            os_name = "windows" if target == "windows" else "linux"
+            ext = "zip" if target == "windows" else "tgz"
+            name = f"mongodb-{os_name}-{arch}-{edition}-{target}-{version}"
+            crypt = (
+                f"mongo_crypt_shared_v1-{os_name}-{arch}-{edition}-{target}-{version}"
+            )
+            archive = {"url": f"{base_url}/{name}.{ext}", "sha256": "0" * 64}
+            crypt_shared = {"url": f"{base_url}/{crypt}.tgz", "sha256": "0" * 64}
+            if version == bench_version and (target, arch) in (
+                ("ubuntu2204", "x86_64"),
+                ("windows", "x86_64"),
+            ):
+                members = _archive_members(rng, name, size, args.files)
+                writer = _write_zip if ext == "zip" else _write_tgz
+                writer(root / f"{name}.{ext}", members)
+                archive["sha256"] = _sha256(root / f"{name}.{ext}")
+                _write_tgz(
+                    root / f"{crypt}.tgz",
+                    {"lib/mongo_crypt_v1.so": _payload(rng, size // 8)},
+                )
+                crypt_shared["sha256"] = _sha256(root / f"{crypt}.tgz")
+            downloads.append(
+                {
+                    "target": target,
+                    "arch": arch,
+                    "edition": edition,
+                    "archive": archive,
+                    "crypt_shared": crypt_shared,
+                }
+            )
+        entries.append(
+            {
+                "version": version,
+                "githash": hashlib.sha1(version.encode()).hexdigest(),
+                "date": "2024-01-01T00:00:00Z",
+                "downloads": downloads,
+            }
+        )
+    with (root / "full.json").open("w", encoding="utf-8") as f:
+        json.dump({"versions": entries}, f, indent=2)
+    return bench_version
+
+
+def _run_once(
+    cache_dir: Path, out_dir: Path, version: str, segments: int
+) -> "dict[str, float]":
+    """
+    Run every stage of the pipeline once with an empty cache. Returns the time
+    in seconds spent in each stage.
+    """
+    timings = {}
+
+    @contextlib.contextmanager
+    def stage(name: str):
+        start = time.perf_counter()
+        yield
+        timings[name] = time.perf_counter() - start
+
+    cache = Cache.open_in(cache_dir, segments)
+    source = os.environ["MONGODB_DOWNLOAD_SOURCE"]
+    with stage("refresh"):
+        full_json = cache.download_file(source)
+    with stage("import"):
+        cache.db.import_json_file(full_json.path)
+    with stage("revalidate"):
+        cache.refresh_full_json(max_age=0)
+    components = [
+        ("ubuntu2204", "archive"),
+        ("ubuntu2204", "crypt_shared"),
+        ("windows", "archive"),
+    ]
+    with stage("resolve"), contextlib.redirect_stdout(io.StringIO()):
+        urls = [
+            _resolve_component_url(
+                cache, version, target, "x86_64", "enterprise", component, None
+            )
+            for target, component in components
+        ]
+    with stage("download"):
+        downloads = [cache.download_file(url) for url, _ in urls]
+    # The digests are computed while downloading, so checking them is free.
+    for dl, (url, sha256) in zip(downloads, urls):
+        if dl.sha256 != sha256:
+            raise RuntimeError(f"Incorrect SHA-256 for [{url}]")
+    with stage("extract"):
+        for idx, dl in enumerate(downloads):
+            cache.expand_archive(dl, out_dir / f"cold{idx}", None, 0, test=False)
+    with stage("extract_cached"):
+        for idx, dl in enumerate(downloads):
+            cache.expand_archive(dl, out_dir / f"warm{idx}", None, 0, test=False)
+    return timings
+
+
+def _summarize(samples: "list[float]") -> "dict[str, float | list[float]]":
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "max": max(samples),
+        "samples": samples,
+    }
+
+
+def compare(results: "dict", baseline: "dict", max_regression: float) -> "list[str]":
+    """
+    Compare the stage timings of 'results' against 'baseline'. Returns a message
+    for every stage that is more than 'max_regression' (a fraction) slower.
+
+    The fastest iteration of each stage is compared, since it is the least
+    affected by other activity on the machine.
+    """
+    regressions = []
+    for name, stats in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        now, before = stats["min"], base["min"]
+        if now < MIN_REGRESSION_TIME or now <= before * (1 + max_regression):
+            continue
+        regressions.append(
+            f"{name}: {now:.4f}s vs {before:.4f}s ({now / before - 1:+.0%})"
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Whether to log at the DEBUG level"
+    )
+    parser.add_argument(
+        "--iterations",
+        "-n",
+        type=int,
+        default=5,
+        help="The number of times to run the pipeline (Default is 5)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="-",
+        metavar="FILE",
+        help="Write the results as JSON to this file (Default is stdout)",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="The directory for the generated files and caches (Default is a "
+        "temporary directory that is removed afterwards)",
+    )
+    gen_grp = parser.add_argument_group("Synthetic data arguments")
+    gen_grp.add_argument(
+        "--versions",
+        type=int,
+        default=500,
+        help="The number of versions listed in full.json (Default is 500)",
+    )
+    gen_grp.add_argument(
+        "--archive-size",
+        type=int,
+        default=32,
+        metavar="MiB",
+        help="The approximate uncompressed size of the server archives (Default is 32)",
+    )
+    gen_grp.add_argument(
+        "--files",
+        type=int,
+        default=200,
+        help="The number of small files in the server archives (Default is 200)",
+    )
+    gen_grp.add_argument(
+        "--seed", type=int, default=0, help="The seed for the synthetic data"
+    )
+    run_grp = parser.add_argument_group("Pipeline arguments")
+    run_grp.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Passed to mongodl's --segments (Default is 1)",
+    )
+    run_grp.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        metavar="MiB/s",
+        help="Throttle every connection of the local server (Default is no limit)",
+    )
+    cmp_grp = parser.add_argument_group("Comparison arguments")
+    cmp_grp.add_argument(
+        "--baseline",
+        type=Path,
+        metavar="FILE",
+        help="Compare against the results of a previous run, and exit non-zero "
+        "if a stage regressed",
+    )
+    cmp_grp.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.25,
+        metavar="FRACTION",
+        help="How much slower the fastest iteration of a stage may be than in "
+        "the baseline (Default is 0.25)",
+    )
+    args = parser.parse_args(argv)
+    DL_LOGGER.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    if args.verbose:
+        LOGGER.setLevel(logging.DEBUG)
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir
+        if workdir is None:
+            workdir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        srv_dir = workdir / "srv"
+        shutil.rmtree(srv_dir, ignore_errors=True)
+        srv_dir.mkdir(parents=True)
+        base_url = stack.enter_context(
+            _serve(srv_dir, int(args.bandwidth * 1024 * 1024))
+        )
+        LOGGER.info("Generating synthetic downloads in %s", srv_dir)
+        version = generate(srv_dir, base_url, args)
+        os.environ["MONGODB_DOWNLOAD_SOURCE"] = f"{base_url}/full.json"
+
+        samples = {name: [] for name in STAGES}  # type: dict[str, list[float]]
+        for idx in range(args.iterations):
+            run_dir = workdir / "run"
+            shutil.rmtree(run_dir, ignore_errors=True)
+            timings = _run_once(
+                run_dir / "cache", run_dir / "out", version, args.segments
+            )
+            LOGGER.info(
+                "Iteration %d: %s",
+                idx + 1,
+                ", ".join(f"{name}={secs:.3f}s" for name, secs in timings.items()),
+            )
+            for name, secs in timings.items():
+                samples[name].append(secs)
+        shutil.rmtree(workdir / "run", ignore_errors=True)
+
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "decompressor": _pick_decompressor(),
+            "config": {
+                "iterations": args.iterations,
+                "versions": args.versions,
+                "archive_size_mib": args.archive_size,
+                "files": args.files,
+                "segments": args.segments,
+                "bandwidth_mib_s": args.bandwidth,
+            },
+            "bytes": {
+                path.name: path.stat().st_size for path in sorted(srv_dir.iterdir())
+            },
+            "stages": {name: _summarize(samples[name]) for name in STAGES},
+        }
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        for msg in regressions:
+            LOGGER.error("Regression in %s", msg)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,8 +23,8 @@ from mongodl import (
     Cache,
     DownloadRetrier,
     ExpandResult,
-    _expand_archive,
     default_cache_dir,
+    default_offline,
     infer_arch,
 )
 
@@ -83,9 +83,9 @@ def _download(
     retrier = DownloadRetrier(retries)
     while True:
         try:
-            cached = cache.download_file(dl_url).path
-            return _expand_archive(
-                cached, out_dir, pattern, strip_components, test=test
+            dl = cache.download_file(dl_url)
+            return cache.expand_archive(
+                dl, out_dir, pattern, strip_components, test=test
             )
         except Exception as e:
             LOGGER.exception(e)
@@ -109,6 +109,13 @@ def main(argv=None):
         default=default_cache_dir(),
         help="Directory where download caches and metadata will be stored",
     )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=default_offline(),
+        help="Only use cached files, and never contact the server. "
+        "(Default is true if MONGODL_OFFLINE is set)",
+    )
     dl_grp = parser.add_argument_group(
         "Download arguments",
         description="Select what to download and extract. "
@@ -190,7 +197,7 @@ def main(argv=None):
         LOGGER.setLevel(logging.WARNING)
         DL_LOGGER.setLevel(logging.WARNING)
 
-    cache = Cache.open_in(args.cache_dir)
+    cache = Cache.open_in(args.cache_dir, offline=args.offline)
     result = _download(
         cache,
         out,
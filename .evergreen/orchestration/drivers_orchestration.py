@@ -7,6 +7,9 @@ Use '--help' for more information.
 from __future__ import annotations
 
 import argparse
+import asyncio
+import hashlib
+import http.client
 import json
 import logging
 import os
@@ -14,15 +17,21 @@ import re
 import shlex
 import shutil
 import socket
+import stat
 import subprocess
 import sys
+import threading
 import time
 import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path, PureWindowsPath
 
 import psutil
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
 
 # Get global values.
 HERE = Path(__file__).absolute().parent
@@ -41,6 +50,92 @@ CRYPT_NAME_MAP = {
 URI_TXT = DRIVERS_TOOLS / "uri.txt"
 MO_EXPANSION_SH = Path("mo-expansion.sh")
 MO_EXPANSION_YML = Path("mo-expansion.yml")
+RESULTS_JSON = DRIVERS_TOOLS / "results.json"
+
+# mongo-orchestration
+ORCHESTRATION_ADDRESS = ("127.0.0.1", 8889)
+START_TIMEOUT = 120
+# Log lines that mean the server will never become ready. A traceback alone is
+# not one: the server logs handled errors too, and keeps running.
+FATAL_LOG_MARKERS = ["Address already in use"]
+# Describes the deployment kept running by "run --reuse-deployment".
+WARM_DEPLOYMENT_JSON = "warm-deployment.json"
+# Databases that are kept when a deployment is reused.
+SYSTEM_DATABASES = ["admin", "config", "local"]
+# The native launcher.
+NATIVE_DB_DIR = "db/native"
+NATIVE_MIN_VERSION = (4, 0)
+# The roles that mongo-orchestration gives to the user of a deployment.
+NATIVE_USER_ROLES = [
+    dict(role=role, db="admin")
+    for role in [
+        "userAdminAnyDatabase",
+        "clusterAdmin",
+        "dbAdminAnyDatabase",
+        "readWriteAnyDatabase",
+        "restore",
+        "backup",
+    ]
+]
+# The tls* names of the legacy ssl* options used in "sslParams", which are
+# deprecated or rejected by recent servers. The tls* names exist since 4.2.
+NATIVE_TLS_VERSION = (4, 2)
+NATIVE_TLS_OPTIONS = {
+    "sslOnNormalPorts": "tlsMode",
+    "sslMode": "tlsMode",
+    "sslPEMKeyFile": "tlsCertificateKeyFile",
+    "sslPEMKeyPassword": "tlsCertificateKeyFilePassword",
+    "sslCAFile": "tlsCAFile",
+    "sslCRLFile": "tlsCRLFile",
+    "sslClusterFile": "tlsClusterFile",
+    "sslClusterPassword": "tlsClusterPassword",
+    "sslWeakCertificateValidation": "tlsAllowConnectionsWithoutCertificates",
+    "sslAllowConnectionsWithoutCertificates": "tlsAllowConnectionsWithoutCertificates",
+    "sslAllowInvalidCertificates": "tlsAllowInvalidCertificates",
+    "sslAllowInvalidHostnames": "tlsAllowInvalidHostnames",
+    "sslDisabledProtocols": "tlsDisabledProtocols",
+    "sslFIPSMode": "tlsFIPSMode",
+}
+NATIVE_TLS_MODES = {
+    "disabled": "disabled",
+    "allowSSL": "allowTLS",
+    "preferSSL": "preferTLS",
+    "requireSSL": "requireTLS",
+}
+# How long to wait for every member of a new deployment to be ready.
+READY_TIMEOUT = 60
+METRICS_JSON = DRIVERS_TOOLS / "orchestration-metrics.json"
+METRICS_OPENMETRICS = DRIVERS_TOOLS / "orchestration-metrics.txt"
+
+
+class StageTimings:
+    """
+    Record how long each stage of a run takes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages: list[dict] = []
+
+    def add(self, name: str, start: float, end: float, **labels: str) -> None:
+        """
+        Record a stage that ran from 'start' to 'end' (as returned by time.time()).
+        Can be called from any thread.
+        """
+        LOGGER.debug(f"Stage {name} {labels or ''} took {end - start:.3f}s")
+        with self._lock:
+            self.stages.append(
+                dict(name=name, start=start, end=end, elapsed=end - start, **labels)
+            )
+
+    @contextmanager
+    def stage(self, name: str, **labels: str):
+        """
+        Record the time spent in the body of the with statement.
+        """
+        start = time.time()
+        yield
+        self.add(name, start, time.time(), **labels)
 
 
 def get_options():
@@ -138,6 +233,20 @@ def get_options():
             "--arch",
             help="the architecture.  if unspecified, the arch will be inferred.",
         )
+        other_group.add_argument(
+            "--native-launcher",
+            action="store_true",
+            help="Start the mongod and mongos processes directly instead of with "
+            "mongo-orchestration, when the orchestration config allows it",
+        )
+        other_group.add_argument(
+            "--reuse-deployment",
+            action="store_true",
+            help="Leave a record of the deployment so that later runs with the same "
+            "options and server version reset and reuse it (dropping all but the "
+            "system databases) instead of downloading and creating it again. Not "
+            "supported with --native-launcher or 'latest' builds",
+        )
 
     other_group.add_argument(
         "--mongo-orchestration-home", help="The path to mongo-orchestration home"
@@ -185,6 +294,9 @@ def get_options():
             opts.topology = "server"
         if not opts.version:
             opts.version = "latest"
+        # The deployment is reset through mongo-orchestration.
+        if opts.reuse_deployment and opts.native_launcher:
+            parser.error("--reuse-deployment can not be used with --native-launcher")
 
     if opts.verbose:
         LOGGER.setLevel(logging.DEBUG)
@@ -373,19 +485,39 @@ def clean_run(opts):
     if mongodb_dir.exists():
         shutil.rmtree(normalize_path(mongodb_dir), ignore_errors=True)
 
-    for path in [URI_TXT, MO_EXPANSION_SH, MO_EXPANSION_YML]:
+    for path in [
+        URI_TXT,
+        MO_EXPANSION_SH,
+        MO_EXPANSION_YML,
+        METRICS_JSON,
+        METRICS_OPENMETRICS,
+    ]:
         path.unlink(missing_ok=True)
 
     crypt_path = DRIVERS_TOOLS / CRYPT_NAME_MAP[PLATFORM]
     crypt_path.unlink(missing_ok=True)
 
+    mo_home = Path(opts.mongo_orchestration_home)
+    (mo_home / WARM_DEPLOYMENT_JSON).unlink(missing_ok=True)
+
 
 def run(opts):
     # Deferred import so we can run as a script without the cli installed.
-    from mongodl import main as mongodl
+    from mongodl import LOGGER as DL_LOGGER
+    from mongodl import (
+        Cache,
+        ComponentSpec,
+        default_cache_max_size,
+        download_components,
+    )
     from mongosh_dl import main as mongosh_dl
 
     LOGGER.info("Running orchestration...")
+    timings = StageTimings()
+    if opts.reuse_deployment and not opts.local_atlas:
+        if run_warm(opts, timings):
+            LOGGER.info("Running orchestration... done.")
+            return
     clean_run(opts)
 
     # NOTE: in general, we need to normalize paths to account for cygwin/Windows.
@@ -399,52 +531,88 @@ def run(opts):
 
     version = opts.version
     cache_dir = DRIVERS_TOOLS / ".local/cache"
-    cache_dir_str = normalize_path(cache_dir)
-    default_args = f"--out {mdb_binaries_str} --cache-dir {cache_dir_str} --retries 5"
     if opts.quiet:
-        default_args += " -q"
+        DL_LOGGER.setLevel(logging.WARNING)
     elif opts.verbose:
-        default_args += " -v"
-
-    if opts.arch:
-        default_args += f" --arch={opts.arch}"
+        DL_LOGGER.setLevel(logging.DEBUG)
 
+    # Gather the components to download with mongodl.
+    specs = []
     if not opts.local_atlas:
-        # Download the archive.
-        args = f"{default_args} --version {version}"
-        args += " --strip-path-components 2 --component archive"
         if not opts.existing_binaries_dir:
-            LOGGER.info(f"Downloading mongodb {version}...")
-            mongodl(shlex.split(args))
-            LOGGER.info(f"Downloading mongodb {version}... done.")
+            specs.append(
+                ComponentSpec(
+                    "archive",
+                    version,
+                    mdb_binaries,
+                    strip_components=2,
+                    arch=opts.arch,
+                )
+            )
         else:
             LOGGER.info(
                 f"Using existing mongod binaries dir: {opts.existing_binaries_dir}"
             )
             shutil.copytree(opts.existing_binaries_dir, mdb_binaries)
 
-        run_command(f"{mdb_binaries_str}/mongod --version")
-
     # Download legacy shell.
     if opts.install_legacy_shell:
-        args = f"{default_args} --version 5.0"
-        args += " --strip-path-components 2 --component shell"
-        LOGGER.INFO("Downloading legacy shell...")
-        mongodl(shlex.split(args))
-        LOGGER.INFO("Downloading legacy shell... done.")
+        specs.append(
+            ComponentSpec(
+                "shell", "5.0", mdb_binaries, strip_components=2, arch=opts.arch
+            )
+        )
 
     # Download crypt shared.
     if not opts.skip_crypt_shared:
-        # Get the download URL for crypt_shared.
         # We download crypt_shared to DRIVERS_TOOLS so that it is on a different
         # path location than the other binaries, which is required for
         # https://github.com/mongodb/specifications/blob/master/source/client-side-encryption/tests/README.md#via-bypassautoencryption
-        args = default_args + (
-            f" --version {version} --strip-path-components 1 --component crypt_shared"
+        specs.append(
+            ComponentSpec(
+                "crypt_shared",
+                version,
+                mdb_binaries,
+                strip_components=1,
+                arch=opts.arch,
+            )
         )
-        LOGGER.info("Downloading crypt_shared...")
-        mongodl(shlex.split(args))
-        LOGGER.info("Downloading crypt_shared... done.")
+
+    # Download mongosh in the background while the other components are fetched.
+    args = f"--out {mdb_binaries_str} --strip-path-components 2 --retries 5"
+    if opts.verbose:
+        args += " -v"
+    elif opts.quiet:
+        args += " -q"
+    names = ", ".join([spec.component for spec in specs] + ["mongosh"])
+    LOGGER.info(f"Downloading {names}...")
+
+    def download_mongosh():
+        with timings.stage("download and extract", component="mongosh"):
+            mongosh_dl(shlex.split(args))
+
+    def on_stage(component: str, stage: str, start: float, end: float):
+        timings.add(stage, start, end, component=component)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        mongosh_future = pool.submit(download_mongosh)
+        if specs:
+            cache = Cache.open_in(cache_dir)
+            with timings.stage("refresh downloads list"):
+                cache.refresh_full_json(versions=[spec.version for spec in specs])
+            download_components(cache, specs, retries=5, on_stage=on_stage)
+        mongosh_future.result()
+    LOGGER.info(f"Downloading {names}... done.")
+
+    # Keep the download cache within the budget set by MONGODL_CACHE_MAX_SIZE.
+    cache_max_size = default_cache_max_size()
+    if specs and cache_max_size is not None:
+        cache.gc(cache_max_size, keep_since=dl_start.timestamp())
+
+    if not opts.local_atlas:
+        run_command(f"{mdb_binaries_str}/mongod --version")
+
+    if not opts.skip_crypt_shared:
         crypt_shared_path = mdb_binaries / CRYPT_NAME_MAP[PLATFORM]
         if crypt_shared_path.exists():
             shutil.move(crypt_shared_path, DRIVERS_TOOLS)
@@ -457,21 +625,13 @@ def run(opts):
         MO_EXPANSION_YML.write_text(crypt_text)
         MO_EXPANSION_SH.write_text(crypt_text.replace(": ", "="))
 
-    # Download mongosh
-    args = f"--out {mdb_binaries_str} --strip-path-components 2 --retries 5"
-    if opts.verbose:
-        args += " -v"
-    elif opts.quiet:
-        args += " -q"
-    LOGGER.info("Downloading mongosh...")
-    mongosh_dl(shlex.split(args))
-    LOGGER.info("Downloading mongosh... done.")
-
     dl_end = datetime.now()
     mo_start = datetime.now()
+    native = False
 
     if opts.local_atlas:
-        uri = start_atlas(opts)
+        with timings.stage("start local atlas"):
+            uri = start_atlas(opts)
     else:
         mo_home = Path(opts.mongo_orchestration_home)
         data = get_orchestration_data(opts)
@@ -480,26 +640,45 @@ def run(opts):
         orch_file = Path(mo_home / "config.json")
         orch_file.write_text(json.dumps(data, indent=2))
 
-        # Start the orchestration.
-        start(opts)
+        if opts.native_launcher:
+            unsupported = native_unsupported(opts, data)
+            if unsupported:
+                LOGGER.info(f"Using mongo-orchestration: {unsupported}")
+            native = not unsupported
 
-        # Configure the server.
-        LOGGER.info("Starting deployment...")
-        url = f"http://localhost:8889/v1/{opts.topology}s"
-        req = urllib.request.Request(
-            url, data=json.dumps(data).encode("utf-8"), method="POST"
-        )
+        if native:
+            LOGGER.info("Starting deployment...")
+            resp = launch_native(opts, data, timings)
+        else:
+            # Start the orchestration.
+            start(opts, timings)
+
+            # Configure the server.
+            LOGGER.info("Starting deployment...")
+            url = f"http://localhost:8889/v1/{opts.topology}s"
+            req = urllib.request.Request(
+                url, data=json.dumps(data).encode("utf-8"), method="POST"
+            )
+            try:
+                # mongo-orchestration only responds once the cluster is ready.
+                with timings.stage("create deployment"):
+                    resp = urllib.request.urlopen(req)
+                    resp = json.loads(resp.read().decode("utf-8"))
+            except urllib.error.HTTPError as e:
+                stop(opts)
+                LOGGER.error("out.log: %s", (mo_home / "out.log").read_text())
+                LOGGER.error("server.log: %s", (mo_home / "server.log").read_text())
+                raise e
+        LOGGER.debug(resp)
         try:
-            resp = urllib.request.urlopen(req)
-        except urllib.error.HTTPError as e:
+            with timings.stage("wait for cluster"):
+                wait_for_cluster(opts, data)
+        except TimeoutError:
             stop(opts)
-            LOGGER.error("out.log: %s", (mo_home / "out.log").read_text())
-            LOGGER.error("server.log: %s", (mo_home / "server.log").read_text())
-            raise e
-        resp = json.loads(resp.read().decode("utf-8"))
-        LOGGER.debug(resp)
+            raise
         LOGGER.info("Starting deployment... done.")
         uri = resp.get("mongodb_auth_uri", resp["mongodb_uri"])
+        deployment_id = resp["id"]
 
     # Handle the cluster uri.
     MO_EXPANSION_YML.touch()
@@ -531,11 +710,237 @@ def run(opts):
             ),
         ]
     )
-    Path(DRIVERS_TOOLS / "results.json").write_text(json.dumps(data, indent=2))
+    data["results"].extend(stage_results(timings))
+    RESULTS_JSON.write_text(json.dumps(data, indent=2))
+    write_metrics(opts, timings)
+
+    if opts.reuse_deployment and not opts.local_atlas:
+        key = deployment_key(opts, data)
+        if key is None:
+            LOGGER.info("Not keeping the deployment: the version is not known")
+        else:
+            save_warm_deployment(opts, key, deployment_id, uri)
 
     LOGGER.info("Running orchestration... done.")
 
 
+def stage_results(timings: StageTimings) -> list[dict]:
+    """
+    Get the results.json entries for the stages of a run.
+    """
+    results = []
+    for stage in timings.stages:
+        label = stage["name"]
+        if "component" in stage:
+            label += f" {stage['component']}"
+        results.append(
+            dict(
+                status="PASS",
+                test_file=f"Orchestration: {label}",
+                start=int(stage["start"]),
+                end=int(stage["end"]),
+                elapsed=stage["elapsed"],
+            )
+        )
+    return results
+
+
+def resolve_version(opts) -> str | None:
+    """
+    Get the exact server version used by a run with 'opts', without downloading
+    it. Returns None for "latest" builds, which are only known once downloaded.
+    """
+    if opts.existing_binaries_dir:
+        version = get_mongod_version(Path(opts.existing_binaries_dir))
+        return ".".join(str(part) for part in version)
+    if opts.version in ("latest", "latest-build"):
+        return None
+
+    # Deferred import so we can run as a script without the cli installed.
+    from mongodl import PERF_VERSIONS, Cache, infer_arch, infer_target
+
+    version = PERF_VERSIONS.get(opts.version, opts.version)
+    cache = Cache.open_in(DRIVERS_TOOLS / ".local/cache")
+    cache.refresh_full_json(versions=[version])
+    matching = cache.db.iter_available(
+        version=version,
+        target=infer_target(version),
+        arch=opts.arch or infer_arch(),
+        edition="enterprise",
+        component="archive",
+        limit=1,
+    )
+    found = next(iter(matching), None)
+    return None if found is None else found.version
+
+
+def deployment_key(opts, data: dict) -> str | None:
+    """
+    Get a key that identifies the deployment created by a run with 'opts' and
+    the orchestration config 'data', or None if the server version it uses is
+    not known yet (see resolve_version()).
+    """
+    version = resolve_version(opts)
+    if version is None:
+        return None
+    options = dict(
+        version=version,
+        arch=opts.arch,
+        topology=opts.topology,
+        existing_binaries_dir=opts.existing_binaries_dir,
+        install_legacy_shell=opts.install_legacy_shell,
+        skip_crypt_shared=opts.skip_crypt_shared,
+        mongodb_binaries=normalize_path(opts.mongodb_binaries),
+        tls_cert_key_file=opts.tls_cert_key_file,
+        config=data,
+    )
+    text = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def save_warm_deployment(opts, key: str, deployment_id: str, uri: str) -> None:
+    """
+    Record the deployment of this run so that a later run can reuse it.
+    """
+    mo_home = Path(opts.mongo_orchestration_home)
+    state = dict(
+        key=key,
+        topology=opts.topology,
+        id=deployment_id,
+        uri=uri,
+        expansion_yml=MO_EXPANSION_YML.read_text(),
+        expansion_sh=MO_EXPANSION_SH.read_text(),
+    )
+    (mo_home / WARM_DEPLOYMENT_JSON).write_text(json.dumps(state, indent=2))
+
+
+def run_warm(opts, timings: StageTimings) -> bool:
+    """
+    Reuse the deployment left running by an earlier run with the same options.
+
+    The deployment is reset by mongo-orchestration, which restarts any member
+    that is not running, and every database other than the system databases
+    is dropped. Returns False if there is no such deployment, or if it could
+    not be reset.
+    """
+    mo_home = Path(opts.mongo_orchestration_home)
+    state_file = mo_home / WARM_DEPLOYMENT_JSON
+    try:
+        state = json.loads(state_file.read_text())
+    except (OSError, ValueError):
+        return False
+    data = get_orchestration_data(opts)
+    key = deployment_key(opts, data)
+    if key is None:
+        LOGGER.info(f"Not reusing the deployment for version {opts.version!r}")
+        return False
+    if state.get("key") != key:
+        LOGGER.info(
+            "The running deployment has different options or server version, "
+            "replacing it."
+        )
+        return False
+    error = _probe_orchestration(timeout=5)
+    if error is not None:
+        LOGGER.info(f"Not reusing the deployment: {error}")
+        state_file.unlink(missing_ok=True)
+        return False
+
+    LOGGER.info("Resetting deployment...")
+    mo_start = datetime.now()
+    url = f"http://localhost:8889/v1/{opts.topology}s/{state['id']}"
+    req = urllib.request.Request(
+        url, data=json.dumps(dict(action="reset")).encode("utf-8"), method="POST"
+    )
+    try:
+        with timings.stage("reset deployment"):
+            urllib.request.urlopen(req).read()
+        with timings.stage("wait for cluster"):
+            wait_for_cluster(opts, data)
+        with timings.stage("drop databases"):
+            drop_databases(opts, state["uri"], data)
+    except (OSError, subprocess.CalledProcessError) as e:
+        LOGGER.warning(f"Could not reset the deployment, replacing it: {e}")
+        state_file.unlink(missing_ok=True)
+        return False
+    LOGGER.info("Resetting deployment... done.")
+
+    uri = state["uri"]
+    MO_EXPANSION_YML.write_text(state["expansion_yml"])
+    MO_EXPANSION_SH.write_text(state["expansion_sh"])
+    URI_TXT.write_text(uri)
+    LOGGER.info(f"Cluster URI: {uri}")
+
+    mo_end = datetime.now()
+    results = [
+        dict(
+            status="PASS",
+            test_file="Orchestration",
+            start=int(mo_start.timestamp()),
+            end=int(mo_end.timestamp()),
+            elapsed=(mo_end - mo_start).total_seconds(),
+        )
+    ]
+    results.extend(stage_results(timings))
+    RESULTS_JSON.write_text(json.dumps(dict(results=results), indent=2))
+    write_metrics(opts, timings)
+    return True
+
+
+def drop_databases(opts, uri: str, data: dict) -> None:
+    """
+    Drop every database other than the system databases using mongosh.
+    """
+    mongosh = Path(opts.mongodb_binaries) / "mongosh"
+    if PLATFORM == "win32":
+        mongosh = mongosh.with_suffix(".exe")
+    script = (
+        f"const keep = {json.dumps(SYSTEM_DATABASES)};"
+        "db.getMongo().getDBNames()"
+        ".filter((name) => !keep.includes(name))"
+        ".forEach((name) => db.getSiblingDB(name).dropDatabase());"
+    )
+    args = [normalize_path(mongosh), uri, "--quiet", "--eval", script]
+    if "sslParams" in data:
+        cert = opts.tls_cert_key_file or DRIVERS_TOOLS / ".evergreen/x509gen/client.pem"
+        args += ["--tls", "--tlsCAFile", data["sslParams"]["sslCAFile"]]
+        args += ["--tlsCertificateKeyFile", normalize_path(cert)]
+    LOGGER.debug(f"Running {mongosh} --eval {script!r}")
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+
+
+def write_metrics(opts, timings: StageTimings) -> None:
+    """
+    Write the stage timings of a run as JSON and in the OpenMetrics text format.
+    """
+    info = dict(platform=PLATFORM, topology=opts.topology, version=opts.version)
+    METRICS_JSON.write_text(json.dumps(dict(info, stages=timings.stages), indent=2))
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    name = "drivers_orchestration_stage_duration_seconds"
+    lines = [
+        f"# TYPE {name} gauge",
+        f"# UNIT {name} seconds",
+        f"# HELP {name} Time spent in each stage of drivers-orchestration run.",
+    ]
+    # A stage that was retried is reported with its last duration, since
+    # OpenMetrics does not allow duplicate samples.
+    samples = {}
+    for stage in timings.stages:
+        labels = dict(info, stage=stage["name"])
+        if "component" in stage:
+            labels["component"] = stage["component"]
+        text = ",".join(
+            f'{key}="{escape(str(value))}"' for key, value in labels.items()
+        )
+        samples[text] = stage["elapsed"]
+    lines += [f"{name}{{{text}}} {value:.6f}" for text, value in samples.items()]
+    lines.append("# EOF")
+    METRICS_OPENMETRICS.write_text("\n".join(lines) + "\n")
+
+
 def clean_start(opts):
     mo_home = Path(opts.mongo_orchestration_home)
     for fname in [
@@ -552,8 +957,10 @@ def clean_start(opts):
                 pass
 
 
-def start(opts):
+def start(opts, timings: StageTimings | None = None):
     # Start mongo-orchestration
+    if timings is None:
+        timings = StageTimings()
 
     # Stop a running server.
     mo_home = Path(opts.mongo_orchestration_home)
@@ -594,8 +1001,6 @@ def start(opts):
     if opts.tls_cert_key_file:
         env["MONGO_ORCHESTRATION_CLIENT_CERT"] = normalize_path(opts.tls_cert_key_file)
 
-    mo_start = datetime.now()
-
     # Start the process.
     args = f"{command} start -e default -f {mo_config_str}"
     args += " --socket-timeout-ms=60000 --bind=127.0.0.1 --enable-majority-read-concern"
@@ -607,13 +1012,14 @@ def start(opts):
     # NOTE: we need to use a separate file id for stdout and close it so Evergreen does not hang.
     output_fid = output_file.open("w")
     try:
-        subprocess.run(
-            shlex.split(args),
-            check=True,
-            stderr=subprocess.STDOUT,
-            stdout=output_fid,
-            env=env,
-        )
+        with timings.stage("start mongo-orchestration"):
+            subprocess.run(
+                shlex.split(args),
+                check=True,
+                stderr=subprocess.STDOUT,
+                stdout=output_fid,
+                env=env,
+            )
     except subprocess.CalledProcessError:
         LOGGER.error("Orchestration failed!")
         LOGGER.error(f"server.log:\n{server_file.read_text().strip()}")
@@ -623,40 +1029,675 @@ def start(opts):
         LOGGER.info(f"out.log:\n{output_file.read_text().strip()}")
 
     # Wait for the server to be available.
+    wait_start = time.time()
+    try:
+        wait_for_orchestration(mo_home)
+    except (RuntimeError, TimeoutError):
+        stop(opts)
+        LOGGER.error("Orchestration failed!")
+        LOGGER.error(f"server.log: {server_file.read_text()}")
+        raise
+    timings.add("wait for mongo-orchestration", wait_start, time.time())
+
+    LOGGER.info("Starting mongo-orchestration... done.")
+
+
+def _probe_orchestration(timeout: float) -> str | None:
+    """
+    Ask mongo-orchestration for its service description. Returns None if it
+    answered, or a description of the error.
+    """
+    conn = http.client.HTTPConnection(*ORCHESTRATION_ADDRESS, timeout=timeout)
+    try:
+        conn.request("GET", "/v1")
+        data = json.loads(conn.getresponse().read().decode("utf-8"))
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        return str(e)
+    finally:
+        conn.close()
+    if data.get("service") != "mongo-orchestration":
+        return f"Unexpected response: {data}"
+    return None
+
+
+def _orchestration_died(mo_home: Path) -> str | None:
+    """
+    Check whether the mongo-orchestration server has already failed. Returns a
+    description of the failure, or None.
+    """
+    pid_file = mo_home / "server.pid"
+    try:
+        pid = int(pid_file.read_text().strip())
+    except (OSError, ValueError):
+        # The server has not written its pid yet.
+        pid = None
+    if pid is not None and not psutil.pid_exists(pid):
+        return f"The server process {pid} exited"
+    for log in ["out.log", "server.log"]:
+        try:
+            text = (mo_home / log).read_text(errors="replace")
+        except OSError:
+            continue
+        for marker in FATAL_LOG_MARKERS:
+            if marker in text:
+                return f"{log} contains {marker!r}"
+    return None
+
+
+def wait_for_orchestration(mo_home: Path, timeout: float = START_TIMEOUT) -> None:
+    """
+    Wait until mongo-orchestration answers HTTP requests.
+
+    Polls with an exponential backoff from 10ms up to 250ms between attempts, and
+    gives up after 'timeout' seconds with a TimeoutError. Raises RuntimeError
+    as soon as the server process is gone or its logs show a fatal error.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = deadline - time.monotonic()
+        error = _probe_orchestration(timeout=max(min(remaining, 5), 0.1))
+        if error is None:
+            LOGGER.debug(f"mongo-orchestration answered after {attempt} attempts")
+            return
+        LOGGER.debug(f"mongo-orchestration is not ready: {error}")
+        died = _orchestration_died(mo_home)
+        if died:
+            raise RuntimeError(f"mongo-orchestration failed to start: {died}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Server failed to start: {error}")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.25)
+
+
+def cluster_members(topology: str, data: dict) -> list[tuple[str, str, list[int]]]:
+    """
+    Get the members of the deployment described by an orchestration config.
+
+    Returns a list of (name, kind, ports) groups, where kind is "server",
+    "replica_set" or "mongos".
+    """
+    if topology == "server":
+        return [("server", "server", [data["procParams"]["port"]])]
+    if topology == "replica_set":
+        ports = [m["procParams"]["port"] for m in data["members"]]
+        return [(data.get("id", "replica set"), "replica_set", ports)]
+    groups = []
+    for shard in data.get("shards", []):
+        params = shard.get("shardParams", {})
+        name = f"shard {shard.get('id', '')}".strip()
+        if "members" in params:
+            ports = [m["procParams"]["port"] for m in params["members"]]
+            groups.append((name, "replica_set", ports))
+        else:
+            groups.append((name, "server", [params["procParams"]["port"]]))
+    for router in data.get("routers", []):
+        groups.append((f"router {router['port']}", "mongos", [router["port"]]))
+    return groups
+
+
+def _client(port: int, tls_options: dict, timeout: float, **kwargs) -> MongoClient:
+    timeout_ms = int(timeout * 1000)
+    return MongoClient(
+        "localhost",
+        port,
+        directConnection=True,
+        serverSelectionTimeoutMS=timeout_ms,
+        connectTimeoutMS=timeout_ms,
+        socketTimeoutMS=timeout_ms,
+        **tls_options,
+        **kwargs,
+    )
+
+
+def _hello(port: int, tls_options: dict, timeout: float) -> dict:
+    # Fail right away while nothing is listening, instead of waiting for the
+    # server selection timeout of the client.
+    with socket.create_connection(("localhost", port), timeout):
+        pass
+    with _client(port, tls_options, timeout) as client:
+        try:
+            return client.admin.command("hello")
+        except OperationFailure as e:
+            # Servers older than 4.4.2 only know the legacy command.
+            if e.code != 59:
+                raise
+            return client.admin.command("isMaster")
+
+
+async def _member_state(port: int, tls_options: dict, timeout: float) -> str:
+    try:
+        reply = await asyncio.to_thread(_hello, port, tls_options, timeout)
+    except (OSError, PyMongoError) as e:
+        return f"unreachable ({type(e).__name__})"
+    if reply.get("msg") == "isdbgrid":
+        return "mongos"
+    if reply.get("isWritablePrimary") or reply.get("ismaster"):
+        return "primary"
+    if reply.get("secondary"):
+        return "secondary"
+    if reply.get("arbiterOnly"):
+        return "arbiter"
+    return "starting"
+
+
+def _group_ready(kind: str, states: list[str]) -> bool:
+    if kind == "replica_set":
+        members_ready = all(s in ["primary", "secondary", "arbiter"] for s in states)
+        return members_ready and states.count("primary") == 1
+    expected = "mongos" if kind == "mongos" else "primary"
+    return all(s == expected for s in states)
+
+
+async def _wait_for_members(
+    groups: list[tuple[str, str, list[int]]],
+    tls_options: dict,
+    timeout: float,
+) -> list[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    ports = sorted({port for _, _, group_ports in groups for port in group_ports})
+    delay = 0.01
     attempt = 0
     while True:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        attempt += 1
+        remaining = deadline - loop.time()
+        probe_timeout = max(min(remaining, 5), 0.1)
+        states = await asyncio.gather(
+            *(_member_state(port, tls_options, probe_timeout) for port in ports)
+        )
+        port_states = dict(zip(ports, states))
+        pending = [
+            f"{name} ({', '.join(f'{p}: {port_states[p]}' for p in group_ports)})"
+            for name, kind, group_ports in groups
+            if not _group_ready(kind, [port_states[p] for p in group_ports])
+        ]
+        if not pending:
+            LOGGER.debug(f"The deployment was ready after {attempt} attempts")
+            return pending
+        LOGGER.debug(f"Waiting for {'; '.join(pending)}")
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return pending
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.25)
+
+
+def client_tls_options(opts, data: dict) -> dict:
+    """
+    Get the TLS options of the clients used to talk to the members of a
+    deployment, which are empty if it does not use TLS.
+    """
+    if "sslParams" not in data:
+        return {}
+    # Only used to set up and check the servers, not to trust them.
+    options = dict(
+        tls=True, tlsAllowInvalidCertificates=True, tlsAllowInvalidHostnames=True
+    )
+    cert = opts.tls_cert_key_file or DRIVERS_TOOLS / ".evergreen/x509gen/client.pem"
+    if Path(cert).exists():
+        options["tlsCertificateKeyFile"] = normalize_path(cert)
+    return options
+
+
+def wait_for_cluster(opts, data: dict, timeout: float = READY_TIMEOUT) -> None:
+    """
+    Wait until every member of the deployment is reachable and in its final
+    state: replica sets have a primary and only secondaries and arbiters
+    otherwise, and routers answer as mongos.
+
+    All of the members are probed concurrently with a "hello" command, with an
+    exponential backoff from 10ms up to 250ms between rounds.  Raises
+    TimeoutError if the deployment is not ready after 'timeout' seconds.
+    """
+    groups = cluster_members(opts.topology, data)
+    tls_options = client_tls_options(opts, data)
+    pending = asyncio.run(_wait_for_members(groups, tls_options, timeout))
+    if pending:
+        raise TimeoutError(
+            f"The deployment is not ready after {timeout}s: {'; '.join(pending)}"
+        )
+
+
+def get_mongod_version(mdb_binaries: Path) -> tuple[int, ...]:
+    """
+    Get the version of the mongod binary in 'mdb_binaries'.
+    """
+    mongod = normalize_path(Path(mdb_binaries) / "mongod")
+    output = subprocess.check_output([mongod, "--version"], encoding="utf-8")
+    match = re.search(r"db version v(\d+)\.(\d+)\.(\d+)", output)
+    if match is None:
+        raise RuntimeError(f"Could not find the mongod version in {output!r}")
+    return tuple(int(part) for part in match.groups())
+
+
+def native_unsupported(opts, data: dict) -> str | None:
+    """
+    Check whether the native launcher can create the deployment described by
+    'data'. Returns the reason it cannot, or None.
+    """
+    version = get_mongod_version(opts.mongodb_binaries)
+    if version < NATIVE_MIN_VERSION:
+        return f"MongoDB {'.'.join(map(str, version))} is not supported"
+    if "configsvrs" in data:
+        return "custom config servers are not supported"
+    for shard in data.get("shards", []):
+        if "members" not in shard.get("shardParams", {}):
+            return "standalone shards are not supported"
+        if "tags" in shard.get("shardParams", {}):
+            return "shard tags are not supported"
+    for key in data.get("sslParams", {}):
+        if key not in NATIVE_TLS_OPTIONS and key not in NATIVE_TLS_OPTIONS.values():
+            return f"the TLS option {key} is not supported"
+    for params in _all_proc_params(data):
+        mechanisms = params.get("setParameter", {}).get("authenticationMechanisms")
+        if mechanisms == "MONGODB-X509":
+            return "X.509-only authentication is not supported"
+    return None
+
+
+def _all_proc_params(data: dict) -> list[dict]:
+    params = [data.get("procParams", {})]
+    params += [m.get("procParams", {}) for m in data.get("members", [])]
+    for shard in data.get("shards", []):
+        members = shard.get("shardParams", {}).get("members", [])
+        params += [m.get("procParams", {}) for m in members]
+    params += data.get("routers", [])
+    return params
+
+
+def _process_options(
+    name: str, params: dict, data: dict, version: tuple[int, ...]
+) -> dict:
+    # The defaults that mongo-orchestration adds to the options of a process.
+    mongos = name == "mongos"
+    options = {} if mongos else {"oplogSize": 100, "logappend": True, "verbose": "v"}
+    options.update(params)
+    options.update(_tls_options(data.get("sslParams", {}), version))
+    set_params = dict(options.get("setParameter", {}))
+    set_params.setdefault("enableTestCommands", 1)
+    if not mongos:
+        set_params.setdefault("maxTransactionLockRequestTimeoutMillis", 25)
+        set_params.setdefault("periodicNoopIntervalSecs", 1)
+        set_params.setdefault("writePeriodicNoops", 1)
+    # featureFlagLoadBalancer was added in 5.0.7 and removed in 6.1.0.
+    if mongos and (5, 0, 7) <= version < (6, 1) and "loadBalancerPort" in set_params:
+        set_params.setdefault("featureFlagLoadBalancer", True)
+    options["setParameter"] = set_params
+    if version >= (4, 1, 7):
+        options.setdefault("networkMessageCompressors", "zstd,zlib,snappy,noop")
+    else:
+        options.setdefault("networkMessageCompressors", "zlib,snappy,noop")
+    # Majority read concern can only be turned off before 5.0.
+    storage_engine = options.get("storageEngine", "wiredTiger")
+    if not mongos and version < (5, 0) and storage_engine == "wiredTiger":
+        options.setdefault("enableMajorityReadConcern", True)
+    return options
+
+
+def _tls_options(ssl_params: dict, version: tuple[int, ...]) -> dict:
+    # Translate the legacy ssl* options to their tls* names.
+    if version < NATIVE_TLS_VERSION:
+        return dict(ssl_params)
+    options = {}
+    for key, value in ssl_params.items():
+        if key == "sslOnNormalPorts":
+            if value:
+                options["tlsMode"] = "requireTLS"
+        elif key == "sslMode":
+            options["tlsMode"] = NATIVE_TLS_MODES.get(value, value)
+        else:
+            options[NATIVE_TLS_OPTIONS.get(key, key)] = value
+    return options
+
+
+def _write_options(path: Path, options: dict) -> None:
+    # Write an options file in the key=value format used by mongo-orchestration.
+    def format_value(value):
+        return json.dumps(value) if isinstance(value, bool) else str(value)
+
+    lines = []
+    for key, value in options.items():
+        if key == "setParameter":
+            for param, param_value in value.items():
+                lines.append(f"setParameter = {param}={format_value(param_value)}")
+        else:
+            lines.append(f"{key}={format_value(value)}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class NativeLauncher:
+    """
+    Create a deployment from an orchestration config by starting the mongod
+    and mongos processes directly, without mongo-orchestration.
+
+    Processes are started with authentication already enabled, and users are
+    created using the localhost exception, so no process has to be restarted.
+    Replica sets, shards and routers are all started concurrently.
+    """
+
+    def __init__(self, opts, data: dict, timings: StageTimings) -> None:
+        self.opts = opts
+        self.data = data
+        self.timings = timings
+        self.version = get_mongod_version(opts.mongodb_binaries)
+        self.tls_options = client_tls_options(opts, data)
+        self.home = Path(opts.mongo_orchestration_home) / NATIVE_DB_DIR
+        self.login = data.get("login")
+        self.password = data.get("password", "")
+        self.auth_source = data.get("authSource", "admin")
+        self.key_file = None
+
+    def launch(self) -> dict:
+        """
+        Create the deployment. Returns the same fields as mongo-orchestration:
+        "id", "mongodb_uri", and "mongodb_auth_uri" if there is a user.
+        """
+        # Remove the files of the previous deployment.
+        if self.home.exists():
+            for path in self.home.rglob("*"):
+                if path.is_file():
+                    path.chmod(stat.S_IWRITE | stat.S_IREAD)
+            shutil.rmtree(self.home)
+        self.home.mkdir(parents=True)
+        if "auth_key" in self.data:
+            self.key_file = self.home / "keyfile"
+            self.key_file.write_text(self.data["auth_key"])
+            self.key_file.chmod(stat.S_IRUSR)
+
+        topology = self.opts.topology
+        if topology == "server":
+            hosts = asyncio.run(self._launch_server())
+        elif topology == "replica_set":
+            hosts = asyncio.run(self._launch_replica_set())
+        else:
+            hosts = asyncio.run(self._launch_sharded_cluster())
+
+        result = dict(
+            id=self.data.get("id", topology), mongodb_uri=f"mongodb://{hosts}"
+        )
+        options = ""
+        if topology == "replica_set":
+            options = f"replicaSet={result['id']}"
+            result["mongodb_uri"] += f"/?{options}"
+        if self.login:
+            credentials = f"{self.login}:{self.password}@"
+            options = "&".join(
+                filter(None, [f"authSource={self.auth_source}", options])
+            )
+            result["mongodb_auth_uri"] = f"mongodb://{credentials}{hosts}/?{options}"
+        return result
+
+    async def _launch_server(self) -> str:
+        params = dict(self.data.get("procParams", {}))
+        if self.login or self.key_file:
+            params["auth"] = True
+        port = await self._start_process(self.data.get("name", "mongod"), params)
+        if self.login:
+            await self._create_user(port)
+        await self._require_api_version([port])
+        return f"localhost:{port}"
+
+    async def _launch_replica_set(self) -> str:
+        ports = await self._start_replica_set(self.data["id"], self.data["members"])
+        return ",".join(f"localhost:{port}" for port in ports)
+
+    async def _launch_sharded_cluster(self) -> str:
+        cluster_id = self.data["id"]
+        enable_ipv6 = any(p.get("ipv6") for p in _all_proc_params(self.data))
+        config_params = dict(configsvr=True, port=_free_port())
+        if enable_ipv6:
+            config_params.update(ipv6=True, bind_ip="127.0.0.1,::1")
+        config_rs = f"{cluster_id}_configRS"
+        configdb = f"{config_rs}/localhost:{config_params['port']}"
+
+        async def start_shard(shard: dict) -> str:
+            members = []
+            for member in shard["shardParams"]["members"]:
+                proc_params = dict(member.get("procParams", {}))
+                if not member.get("rsParams", {}).get("arbiterOnly"):
+                    proc_params["shardsvr"] = True
+                members.append(dict(member, procParams=proc_params))
+            ports = await self._start_replica_set(shard["id"], members)
+            return f"{shard['id']}/{','.join(f'localhost:{p}' for p in ports)}"
+
+        async def start_router(router: dict) -> int:
+            return await self._start_process("mongos", dict(router, configdb=configdb))
+
+        shards = self.data.get("shards", [])
+        routers = self.data.get("routers", [])
+        results = await asyncio.gather(
+            # Users of the cluster are created through a router instead.
+            self._start_replica_set(
+                config_rs, [dict(procParams=config_params)], create_user=False
+            ),
+            *(start_shard(shard) for shard in shards),
+            *(start_router(router) for router in routers),
+        )
+        shard_uris = results[1 : 1 + len(shards)]
+        router_ports = results[1 + len(shards) :]
+
+        if self.login:
+            await self._create_user(router_ports[0])
+        start = time.time()
+        await asyncio.gather(
+            *(
+                self._command(router_ports[0], dict(addShard=uri, name=shard["id"]))
+                for shard, uri in zip(shards, shard_uris)
+            )
+        )
+        self.timings.add("add shards", start, time.time())
+        await self._require_api_version(router_ports)
+        return ",".join(f"localhost:{port}" for port in router_ports)
+
+    async def _start_replica_set(
+        self, rs_id: str, members: list[dict], create_user=True
+    ) -> list[int]:
+        """
+        Start the members of a replica set concurrently and initiate it. Returns
+        the member ports.
+        """
+        config_members = []
+        starts = []
+        for i, member in enumerate(members):
+            params = dict(replSet=rs_id, **member.get("procParams", {}))
+            starts.append(self._start_process("mongod", params))
+            rs_params = member.get("rsParams", {})
+            config_members.append(
+                dict(_id=i, host=f"localhost:{params['port']}", **rs_params)
+            )
+        ports = await asyncio.gather(*starts)
+
+        start = time.time()
+        config = dict(_id=rs_id, members=config_members)
+        if "rsSettings" in self.data:
+            config["settings"] = self.data["rsSettings"]
+        # Initiate from a member that can become primary.
+        init_port = next(
+            port
+            for port, member in zip(ports, config_members)
+            if not member.get("arbiterOnly") and member.get("priority", 1) != 0
+        )
+        await self._command(init_port, dict(replSetInitiate=config), authenticate=False)
+        pending = await _wait_for_members(
+            [(rs_id, "replica_set", ports)], self.tls_options, START_TIMEOUT
+        )
+        if pending:
+            raise TimeoutError(f"Replica set did not become ready: {pending[0]}")
+        self.timings.add("initiate", start, time.time(), component=rs_id)
+
+        if self.login and create_user:
+            states = await asyncio.gather(
+                *(_member_state(port, self.tls_options, 5) for port in ports)
+            )
+            primary = ports[states.index("primary")]
+            data_members = [m for m in config_members if not m.get("arbiterOnly")]
+            await self._create_user(primary, dict(w=len(data_members)))
+        return ports
+
+    async def _start_process(self, name: str, params: dict) -> int:
+        """
+        Start a mongod or mongos and wait until it answers. Returns its port.
+        """
+        start = time.time()
+        options = _process_options(name, params, self.data, self.version)
+        if self.key_file:
+            options["keyFile"] = normalize_path(self.key_file)
+        port = options["port"]
+        # Otherwise we would wait for whatever is listening there instead.
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                raise RuntimeError(f"Port {port} is already in use")
+        proc_dir = self.home / f"{name}-{port}"
+        proc_dir.mkdir()
+        options["logpath"] = normalize_path(proc_dir / f"{name}.log")
+        if name != "mongos":
+            options["dbpath"] = normalize_path(proc_dir)
+        config = proc_dir / f"{name}.conf"
+        _write_options(config, options)
+
+        binary = Path(self.opts.mongodb_binaries) / name
+        args = [normalize_path(binary), "--config", normalize_path(config)]
+        LOGGER.debug(f"Starting {' '.join(args)}")
+        with (self.home / "out.log").open("a") as out:
+            # Start a new session so that the process outlives this one.
+            proc = subprocess.Popen(
+                args, stdout=out, stderr=subprocess.STDOUT, start_new_session=True
+            )
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + START_TIMEOUT
+        delay = 0.01
+        while True:
             try:
-                s.connect(("localhost", 8889))
+                await asyncio.to_thread(_hello, port, self.tls_options, 5)
                 break
-            except ConnectionRefusedError:
-                if (datetime.now() - mo_start).seconds > 120:
-                    stop(opts)
-                    LOGGER.error("Orchestration failed!")
-                    LOGGER.error(f"server.log: {server_file.read_text()}")
-                    raise TimeoutError("Server failed to start") from None
-        attempt += 1
-        time.sleep(attempt * 1000)
+            except (OSError, PyMongoError):
+                pass
+            if proc.poll() is not None:
+                log = Path(options["logpath"])
+                tail = log.read_text(errors="replace")[-2000:] if log.exists() else ""
+                raise RuntimeError(
+                    f"{name} on port {port} exited with code {proc.returncode}:\n{tail}"
+                )
+            if loop.time() >= deadline:
+                raise TimeoutError(f"{name} on port {port} did not start")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        self.timings.add("start", start, time.time(), component=f"{name} {port}")
+        return port
+
+    async def _command(
+        self, port: int, command: dict, authenticate=True, db: str = "admin"
+    ) -> dict:
+        def run() -> dict:
+            credentials = {}
+            if authenticate and self.login:
+                credentials = dict(
+                    username=self.login,
+                    password=self.password,
+                    authSource=self.auth_source,
+                )
+            with _client(
+                port, self.tls_options, START_TIMEOUT, **credentials
+            ) as client:
+                return client[db].command(command)
+
+        return await asyncio.to_thread(run)
+
+    async def _create_user(self, port: int, write_concern: dict | None = None) -> None:
+        # There are no users yet, so the localhost exception allows this.
+        command = dict(
+            createUser=self.login, pwd=self.password, roles=NATIVE_USER_ROLES
+        )
+        if write_concern:
+            command["writeConcern"] = write_concern
+        await self._command(port, command, authenticate=False, db=self.auth_source)
 
-    LOGGER.info("Starting mongo-orchestration... done.")
+    async def _require_api_version(self, ports: list[int]) -> None:
+        if not self.data.get("requireApiVersion"):
+            return
+        version = int(self.data["requireApiVersion"])
+        command = dict(setParameter=1, requireApiVersion=version)
+        await asyncio.gather(*(self._command(port, command) for port in ports))
+
+
+def launch_native(opts, data: dict, timings: StageTimings) -> dict:
+    """
+    Create the deployment with the native launcher instead of mongo-orchestration.
+    """
+    # Stop the processes of a previous deployment that use the same ports.
+    stop(opts)
+    clean_start(opts)
+    try:
+        with timings.stage("create deployment"):
+            return NativeLauncher(opts, data, timings).launch()
+    except (OSError, RuntimeError, PyMongoError):
+        stop(opts)
+        raise
 
 
-def shutdown_proc(proc: psutil.Process) -> None:
+def find_processes(pid_file: Path) -> dict[int, tuple[psutil.Process, str]]:
+    """
+    Find the processes to stop in a single pass over the process table:
+    mongo-orchestration (by pid file and by command line) and any process
+    named mongod or mongos. Returns a description of each, by pid.
+    """
+    found = {}
     try:
-        proc.terminate()
+        pid = int(pid_file.read_text().strip())
+        found[pid] = (psutil.Process(pid), "mongo-orchestration")
+    except (OSError, ValueError, psutil.NoSuchProcess):
+        pass
+    # Never stop this process or the shell that started it.
+    ours = {os.getpid()} | {parent.pid for parent in psutil.Process().parents()}
+    for proc in psutil.process_iter(["name", "cmdline"]):
+        if proc.pid in ours or proc.pid in found:
+            continue
+        name = proc.info["name"]
+        cmdline = proc.info["cmdline"] or []
+        if any(
+            "mongo_orchestration.server" in item or "mongo-orchestration" in item
+            for item in cmdline
+        ):
+            found[proc.pid] = (proc, "mongo-orchestration")
+        elif name in ["mongod", "mongos"]:
+            found[proc.pid] = (proc, name)
+    return found
+
+
+def shutdown_procs(procs: list[psutil.Process], timeout: float = 10) -> None:
+    """
+    Wait for processes that were sent SIGTERM to exit, and kill the ones that
+    are still running after 'timeout' seconds.
+    """
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        LOGGER.info(f"Killing process {proc.pid}")
         try:
-            proc.wait(10)  # Wait up to 10 seconds.
-        except psutil.TimeoutExpired:
             proc.kill()
-    except Exception as e:
-        LOGGER.exception(e)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.Error as e:
+            LOGGER.exception(e)
+    psutil.wait_procs(alive, timeout=timeout)
 
 
-def shutdown_docker(docker: str, container_id: str) -> None:
+def shutdown_docker(docker: str, container_ids: list[str]) -> None:
+    ids = " ".join(container_ids)
     if "podman" in docker:
-        cmd = f"{docker} rm -f {container_id}"
+        cmd = f"{docker} rm -f {ids}"
     else:
-        cmd = f"{docker} kill {container_id}"
+        cmd = f"{docker} kill {ids}"
     run_command(cmd, exit_on_error=False)
 
 
@@ -665,44 +1706,28 @@ def stop(opts):
     pid_file = mo_home / "server.pid"
     container_file = mo_home / "container_id.txt"
     docker = get_docker_cmd()
-
-    # First try to shut down using pid file.
-    if pid_file.exists():
-        pid = int(pid_file.read_text().strip())
-        pid_file.unlink(missing_ok=True)
-        if psutil.pid_exists(pid):
-            LOGGER.info("Stopping mongo-orchestration using pid file...")
-            shutdown_proc(psutil.Process(pid))
-            LOGGER.info("Stopping mongo-orchestration using pid file... done.")
-
-    # Next try using a docker container file.
-    if docker is not None and container_file.exists():
-        LOGGER.info("Stopping mongodb_atlas_local using container file...")
-        shutdown_docker(docker, container_file.read_text())
-        container_file.unlink()
-        LOGGER.info("Stopping mongodb_atlas_local using container file ... done.")
-
-    all_procs = list(psutil.process_iter())
-
-    # Next look for mongo-orchestration by command line arguments.
-    for proc in all_procs:
+    (mo_home / WARM_DEPLOYMENT_JSON).unlink(missing_ok=True)
+
+    # Ask every process to stop at once, and wait for them below.
+    procs = []
+    found = find_processes(pid_file)
+    pid_file.unlink(missing_ok=True)
+    for pid, (proc, description) in found.items():
+        LOGGER.info(f"Stopping {description} ({pid})...")
         try:
-            cmdline = proc.cmdline()
-        except (psutil.AccessDenied, psutil.NoSuchProcess):
-            continue
-        found = False
-        for item in cmdline:
-            if "mongo_orchestration.server" in item or "mongo-orchestration" in item:
-                found = True
-                break
-        if not found:
-            continue
-        LOGGER.info("Stopping mongo-orchestration by process info...")
-        shutdown_proc(proc)
-        LOGGER.info("Stopping mongo-orchestration by process info... done.")
+            proc.terminate()
+            procs.append(proc)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.Error as e:
+            LOGGER.exception(e)
 
-    # Next look for running docker images.
+    # Stop the containers while the processes shut down.
     if docker:
+        container_ids = []
+        if container_file.exists():
+            container_ids.append(container_file.read_text().strip())
+            container_file.unlink()
         cmd = f"{docker} ps --format '{{{{.Image}}}}\t{{{{.ID}}}}'"
         try:
             response = subprocess.check_output(
@@ -714,20 +1739,22 @@ def stop(opts):
         for line in response.splitlines():
             image, container_id = line.split("\t")
             if image in ["mongodb/mongodb-atlas-local", "mongo"]:
-                LOGGER.info(f"Stopping {image} by image name...")
-                shutdown_docker(docker, container_id)
-                LOGGER.info(f"Stopping {image} by image name... done.")
-
-    # Finally, look for any processes that are named mongod or mongos.
-    for proc in all_procs:
-        try:
-            name = proc.name()
-        except psutil.NoSuchProcess:
-            continue
-        if name in ["mongod", "mongos"]:
-            LOGGER.info(f"Stopping {name} by process name...")
-            shutdown_proc(proc)
-            LOGGER.info(f"Stopping {name} by process name... done.")
+                container_ids.append(container_id)
+        # The container file holds the full id, and docker ps a prefix of it.
+        container_ids = [
+            cid
+            for cid in container_ids
+            if not any(o != cid and o.startswith(cid) for o in container_ids)
+        ]
+        container_ids = list(dict.fromkeys(container_ids))
+        if container_ids:
+            LOGGER.info(f"Stopping containers {', '.join(container_ids)}...")
+            shutdown_docker(docker, container_ids)
+            LOGGER.info(f"Stopping containers {', '.join(container_ids)}... done.")
+
+    if procs:
+        shutdown_procs(procs)
+        LOGGER.info(f"Stopping {len(procs)} processes... done.")
 
 
 def main():
@@ -1,11 +1,168 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import collections
+import errno
+import functools
+import http.server
+import itertools
+import json
+import os
 import re
-import select
+import selectors
 import socket
 import socketserver
+import sys
+import threading
+import time
 
-# Usage: python3 socks5srv.py --port port [--auth username:password] [--map 'host:port to host:port' ...]
+# Usage: python3 socks5srv.py --port port [--auth username:password] [--map 'host:port to host:port' ...] [--asyncio]
+#            [--stats-port port] [--stats-file file [--stats-interval seconds]]
+#            [--dns-ttl seconds] [--happy-eyeballs-delay seconds] [--pool-size n]
+
+# Size of the buffers (and pipes) used to forward proxied data
+BUFFER_SIZE = 64 * 1024
+
+# Maximum size of a single read while receiving the Socks5 handshake
+HANDSHAKE_RECV_SIZE = 4096
+
+# Seconds to wait before accepting again when out of file descriptors
+ACCEPT_RETRY_DELAY = 0.1
+
+# Seconds between checks of the idle connections of the connection pool
+POOL_CHECK_INTERVAL = 1
+
+# connect_ex() results of a non-blocking connect that is still in progress.
+# Windows reports WSAEWOULDBLOCK, which differs from EWOULDBLOCK there.
+CONNECT_IN_PROGRESS = (
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    errno.EAGAIN,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+)
+
+# Number of closed connections that are listed in the stats
+RECENT_CONNECTIONS = 100
+
+# Number of recent handshake/connect durations used for percentiles
+RECENT_DURATIONS = 10000
+
+# os.splice() flags, the constants only exist where os.splice() does
+SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+
+@functools.lru_cache(maxsize=None)
+def splice_supported():
+    """Whether os.splice() can move data between sockets on this system
+
+    os.splice() only exists on Linux with Python 3.10+, and some kernels or
+    sandboxes reject it for sockets, so actually try it once."""
+
+    if not hasattr(os, "splice"):
+        return False
+    a, b = socket.socketpair()
+    pipe_r, pipe_w = os.pipe()
+    try:
+        a.sendall(b"x")
+        if os.splice(b.fileno(), pipe_w, 1) != 1:
+            return False
+        return os.splice(pipe_r, a.fileno(), 1) == 1 and b.recv(1) == b"x"
+    except OSError:
+        return False
+    finally:
+        for fd in (pipe_r, pipe_w):
+            os.close(fd)
+        a.close()
+        b.close()
+
+
+class CopyForwarder:
+    """Forwards data from one non-blocking socket to another
+
+    The data goes through a preallocated buffer, which is only refilled
+    once all of its data was sent."""
+
+    def __init__(self, src, dst, count):
+        self.src = src
+        self.dst = dst
+        self.count = count
+        self.buf = memoryview(bytearray(BUFFER_SIZE))
+        self.data = self.buf[:0]
+
+    @property
+    def pending(self):
+        """The number of bytes that were received but not yet sent"""
+
+        return len(self.data)
+
+    def fill(self):
+        """Receive the data that is available on src, return False on EOF"""
+
+        try:
+            n = self.src.recv_into(self.buf)
+        except BlockingIOError:
+            return True
+        if n == 0:
+            return False
+        self.data = self.buf[:n]
+        return True
+
+    def flush(self):
+        """Send as much of the pending data as dst accepts"""
+
+        try:
+            n = self.dst.send(self.data)
+        except BlockingIOError:
+            return
+        self.data = self.data[n:]
+        self.count(n)
+
+    def close(self):
+        pass
+
+
+class SpliceForwarder:
+    """Forwards data from one non-blocking socket to another with os.splice()
+
+    The data is moved through a pipe, so it stays in the kernel and never
+    becomes a Python object."""
+
+    def __init__(self, src, dst, count):
+        self.src = src
+        self.dst = dst
+        self.count = count
+        self.pending = 0
+        self.pipe_r, self.pipe_w = os.pipe()
+
+    def fill(self):
+        """Move the data that is available on src into the pipe, return False on EOF"""
+
+        try:
+            n = os.splice(
+                self.src.fileno(), self.pipe_w, BUFFER_SIZE, flags=SPLICE_FLAGS
+            )
+        except BlockingIOError:
+            return True
+        if n == 0:
+            return False
+        self.pending += n
+        return True
+
+    def flush(self):
+        """Move as much of the data in the pipe as dst accepts"""
+
+        try:
+            n = os.splice(
+                self.pipe_r, self.dst.fileno(), self.pending, flags=SPLICE_FLAGS
+            )
+        except BlockingIOError:
+            return
+        self.pending -= n
+        self.count(n)
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
 
 
 class AddressRemapper:
@@ -18,11 +175,33 @@ class AddressRemapper:
     """
 
     def __init__(self, mappings):
-        self.mappings = [
-            AddressRemapper.parse_single_mapping(string) for string in mappings
-        ]
+        # Maps normalized source (host, port) tuples to destinations, the
+        # first mapping for a source wins
+        self.mappings = {}
+        for string in mappings:
+            src, dst = AddressRemapper.parse_single_mapping(string)
+            self.mappings.setdefault(AddressRemapper.normalize(src), dst)
         self.add_dns_remappings()
 
+    @staticmethod
+    def normalize(hostport):
+        """Normalize a (host, port) tuple for use as a key of self.mappings
+
+        Hosts may be bytes or str. IPv6 addresses are put in their canonical
+        text form (e.g. '0000:0000:0000:0000:0000:0000:0000:0001' and '::1'
+        are the same), and host names are case-insensitive."""
+
+        host, port = hostport
+        if isinstance(host, bytes):
+            host = host.decode("utf8")
+        if ":" in host:
+            try:
+                raw = socket.inet_pton(socket.AF_INET6, host)
+                host = socket.inet_ntop(socket.AF_INET6, raw)
+            except OSError:
+                pass
+        return (host.lower(), port)
+
     @staticmethod
     def parse_single_mapping(string):
         """Parse a single mapping of the for '{host}:{port} to {host}:{port}'"""
@@ -57,40 +236,461 @@ class AddressRemapper:
         For example, if there is a mapping (localhost, 1000) to (localhost, 2000),
         then this also adds (127.0.0.1, 1000) to (localhost, 2000)."""
 
-        for src, dst in self.mappings:
-            host, port = src
+        for src, dst in list(self.mappings.items()):
             try:
-                addrs = socket.getaddrinfo(
-                    host, port, socket.AF_UNSPEC, socket.SOCK_STREAM
-                )
+                addrs = socket.getaddrinfo(*src, socket.AF_UNSPEC, socket.SOCK_STREAM)
             except socket.gaierror:
                 continue
 
-            existing_src_entries = [src for src, dst in self.mappings]
             for af, socktype, proto, canonname, sa in addrs:
-                if af == socket.AF_INET and sa not in existing_src_entries:
-                    self.mappings.append((sa, dst))
-                elif af == socket.AF_INET6 and sa[:2] not in existing_src_entries:
-                    self.mappings.append((sa[:2], dst))
+                if af in (socket.AF_INET, socket.AF_INET6):
+                    self.mappings.setdefault(AddressRemapper.normalize(sa[:2]), dst)
 
     def remap(self, hostport):
         """Re-map a (host, port) tuple to a new (host, port) tuple if that was requested"""
 
-        for src, dst in self.mappings:
-            if hostport == src:
-                return dst
-        return hostport
+        return self.mappings.get(AddressRemapper.normalize(hostport), hostport)
+
+
+class DnsCache:
+    """Caches getaddrinfo() results for ttl seconds
+
+    getaddrinfo() does not report the TTL of the DNS records, so a fixed
+    one is used. The cache is shared by all connections; a race between
+    them only leads to a redundant lookup."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+
+    def lookup(self, host, port):
+        """Return the cached addresses of host:port, or None"""
+
+        entry = self.entries.get((host, port))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def store(self, host, port, addrs):
+        if self.ttl > 0:
+            self.entries[(host, port)] = (time.monotonic() + self.ttl, addrs)
+
+    def resolve(self, host, port):
+        """Return the addresses of host:port, from the cache if possible"""
+
+        addrs = self.lookup(host, port)
+        if addrs is None:
+            addrs = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+            self.store(host, port, addrs)
+        return addrs
+
+
+def interleave_addresses(addrs):
+    """Order getaddrinfo() results by alternating address families
+
+    As described in RFC 8305 section 4, the first family is the one
+    getaddrinfo() prefers, and the order within a family is kept."""
+
+    families = {}
+    for addr in addrs:
+        families.setdefault(addr[0], []).append(addr)
+    return [
+        addr
+        for group in itertools.zip_longest(*families.values())
+        for addr in group
+        if addr is not None
+    ]
+
+
+def happy_eyeballs_connect(addrs, delay):
+    """Connect to the first of the getaddrinfo() results addrs that accepts
+
+    This implements the connection racing of RFC 8305: the addresses are
+    tried in interleaved order, and a new attempt starts whenever the
+    previous one failed or has not succeeded within delay seconds, while
+    the earlier attempts keep going. The first established connection is
+    returned as a blocking socket, or None if all of them failed."""
+
+    queue = collections.deque(interleave_addresses(addrs))
+    attempts = set()
+    next_attempt = 0
+    selector_class = getattr(selectors, "PollSelector", selectors.SelectSelector)
+    with selector_class() as selector:
+        try:
+            while queue or attempts:
+                now = time.monotonic()
+                if queue and (not attempts or now >= next_attempt):
+                    af, socktype, proto, canonname, sa = queue.popleft()
+                    try:
+                        sock = socket.socket(af, socktype, proto)
+                    except OSError:
+                        continue
+                    sock.setblocking(False)
+                    err = sock.connect_ex(sa)
+                    if err == 0:
+                        sock.setblocking(True)
+                        return sock
+                    if err not in CONNECT_IN_PROGRESS:
+                        sock.close()
+                        next_attempt = 0
+                        continue
+                    attempts.add(sock)
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    next_attempt = now + delay
+                    continue
+
+                timeout = max(0, next_attempt - now) if queue else None
+                for key, _ in selector.select(timeout):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    attempts.discard(sock)
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        sock.setblocking(True)
+                        return sock
+                    sock.close()
+                    # Start the next attempt right away
+                    next_attempt = 0
+            return None
+        finally:
+            for sock in attempts:
+                sock.close()
+
+
+async def async_happy_eyeballs_connect(loop, addrs, delay):
+    """Asyncio counterpart of happy_eyeballs_connect, returns a non-blocking socket"""
+
+    async def attempt(af, socktype, proto, sa):
+        sock = socket.socket(af, socktype, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sa)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    queue = collections.deque(interleave_addresses(addrs))
+    attempts = set()
+    try:
+        while queue or attempts:
+            if queue:
+                af, socktype, proto, canonname, sa = queue.popleft()
+                attempts.add(loop.create_task(attempt(af, socktype, proto, sa)))
+            done, attempts = await asyncio.wait(
+                attempts,
+                timeout=delay if queue else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            connected = [task.result() for task in done if task.exception() is None]
+            for sock in connected[1:]:
+                sock.close()
+            if connected:
+                return connected[0]
+        return None
+    finally:
+        for task in attempts:
+            task.cancel()
+
+
+def open_connection(dns_cache, host, port, delay):
+    """Resolve host:port through dns_cache and connect to it, or return None"""
+
+    try:
+        addrs = dns_cache.resolve(host, port)
+    except socket.gaierror:
+        return None
+    return happy_eyeballs_connect(addrs, delay)
+
+
+def is_alive(sock):
+    """Whether the peer has not closed the idle connection sock"""
+
+    sock.setblocking(False)
+    try:
+        return sock.recv(1, socket.MSG_PEEK) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.setblocking(True)
+
+
+class ConnectionPool:
+    """Keeps idle connections to the mapped destinations open ahead of time
+
+    A background thread keeps up to size connections to every destination
+    established, so that a client can be handed one right away. Idle
+    connections that the destination closed are dropped and replaced."""
+
+    def __init__(self, destinations, size, dns_cache, delay):
+        self.size = size
+        self.dns_cache = dns_cache
+        self.delay = delay
+        self.idle = {dst: collections.deque() for dst in destinations}
+        self.wanted = threading.Event()
+        self.wanted.set()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def get(self, dst):
+        """Take an idle connection to dst, or return None if there is none"""
+
+        idle = self.idle.get(dst)
+        sock = None
+        while idle:
+            try:
+                sock = idle.popleft()
+            except IndexError:
+                return None
+            if is_alive(sock):
+                break
+            sock.close()
+            sock = None
+        self.wanted.set()
+        return sock
+
+    def run(self):
+        while True:
+            self.wanted.wait(POOL_CHECK_INTERVAL)
+            self.wanted.clear()
+            for (host, port), idle in self.idle.items():
+                for _ in range(len(idle)):
+                    try:
+                        sock = idle.popleft()
+                    except IndexError:
+                        # Handlers took the remaining connections meanwhile
+                        break
+                    if is_alive(sock):
+                        idle.append(sock)
+                    else:
+                        sock.close()
+                while len(idle) < self.size:
+                    sock = open_connection(self.dns_cache, host, port, self.delay)
+                    if sock is None:
+                        break
+                    idle.append(sock)
+
+
+def create_connection_pool(address_remapper, dns_cache, args):
+    """Create the connection pool for the mapped destinations, if requested"""
+
+    if args.pool_size <= 0:
+        return None
+    destinations = set(address_remapper.mappings.values())
+    return ConnectionPool(
+        destinations, args.pool_size, dns_cache, args.happy_eyeballs_delay
+    )
+
+
+class ConnectionStats:
+    """Counters of a single proxied connection"""
+
+    def __init__(self, client_address):
+        self.client = "{}:{}".format(*client_address[:2])
+        self.target = None
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.connect_start = None
+        self.handshake_time = None
+        self.connect_time = None
+        self.connected = False
+        self.bytes_from_client = 0
+        self.bytes_from_upstream = 0
+
+    def handshake_done(self, dst, port):
+        """Record that the client requested a connection to dst:port"""
+
+        self.connect_start = time.monotonic()
+        self.handshake_time = self.connect_start - self.start
+        if isinstance(dst, bytes):
+            dst = dst.decode("utf8")
+        self.target = f"[{dst}]:{port}" if ":" in dst else f"{dst}:{port}"
+
+    def connect_done(self, connected):
+        """Record the outcome of the connection to the target"""
+
+        self.connect_time = time.monotonic() - self.connect_start
+        self.connected = connected
+
+    def from_client(self, n):
+        self.bytes_from_client += n
+
+    def from_upstream(self, n):
+        self.bytes_from_upstream += n
+
+    def as_dict(self):
+        return {
+            "client": self.client,
+            "target": self.target,
+            "started_at": self.started_at,
+            "duration": time.monotonic() - self.start,
+            "handshake_time": self.handshake_time,
+            "connect_time": self.connect_time,
+            "connected": self.connected,
+            "bytes_from_client": self.bytes_from_client,
+            "bytes_from_upstream": self.bytes_from_upstream,
+        }
+
+
+class DurationStats:
+    """Count, mean and maximum of durations, with percentiles of recent ones"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=RECENT_DURATIONS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def as_dict(self):
+        if not self.count:
+            return {"count": 0}
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "median": recent[len(recent) // 2],
+            "p99": recent[len(recent) * 99 // 100],
+            "max": self.max,
+        }
+
+
+class ProxyStats:
+    """Counters of all the connections handled by a Socks5 server
+
+    The stats are updated by every connection and read by the stats
+    endpoint, so the shared state is only changed while holding a lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.active = set()
+        self.recent = collections.deque(maxlen=RECENT_CONNECTIONS)
+        self.connections = 0
+        self.incomplete_handshakes = 0
+        self.failed_connects = 0
+        self.bytes_from_client = 0
+        self.bytes_from_upstream = 0
+        self.handshake_times = DurationStats()
+        self.connect_times = DurationStats()
+
+    def open(self, client_address):
+        """Start counting a new connection, returns its ConnectionStats"""
+
+        conn = ConnectionStats(client_address)
+        with self.lock:
+            self.connections += 1
+            self.active.add(conn)
+        return conn
+
+    def close(self, conn):
+        """Add the counters of a closed connection to the totals"""
+
+        with self.lock:
+            self.active.discard(conn)
+            self.recent.append(conn.as_dict())
+            self.bytes_from_client += conn.bytes_from_client
+            self.bytes_from_upstream += conn.bytes_from_upstream
+            if conn.handshake_time is None:
+                self.incomplete_handshakes += 1
+                return
+            self.handshake_times.add(conn.handshake_time)
+            if conn.connect_time is not None:
+                self.connect_times.add(conn.connect_time)
+            if not conn.connected:
+                self.failed_connects += 1
+
+    def snapshot(self):
+        """Return the current stats as a JSON-serializable dict"""
+
+        with self.lock:
+            active = [conn.as_dict() for conn in self.active]
+            return {
+                "started_at": self.started_at,
+                "uptime": time.time() - self.started_at,
+                "connections": self.connections,
+                "active_connections": len(active),
+                "incomplete_handshakes": self.incomplete_handshakes,
+                "failed_connects": self.failed_connects,
+                "bytes_from_client": self.bytes_from_client
+                + sum(conn["bytes_from_client"] for conn in active),
+                "bytes_from_upstream": self.bytes_from_upstream
+                + sum(conn["bytes_from_upstream"] for conn in active),
+                "handshake_time": self.handshake_times.as_dict(),
+                "connect_time": self.connect_times.as_dict(),
+                "active": active,
+                "recent": list(self.recent),
+            }
+
+
+class StatsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the stats of the proxy as JSON on every GET request"""
+
+    def do_GET(self):
+        body = json.dumps(self.server.stats.snapshot(), indent=2).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_stats(stats, port):
+    """Serve the stats on localhost:port from a background thread"""
+
+    server = http.server.ThreadingHTTPServer(("localhost", port), StatsHandler)
+    server.daemon_threads = True
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def dump_stats(stats, path, interval):
+    """Write the stats as JSON to path every interval seconds from a background thread"""
+
+    def dump():
+        while True:
+            time.sleep(interval)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(stats.snapshot(), f, indent=2)
+            os.replace(tmp, path)
+
+    threading.Thread(target=dump, daemon=True).start()
+
+
+def start_stats(stats, args):
+    """Start the stats endpoint and the stats file writer, if requested"""
+
+    if args.stats_port is not None:
+        serve_stats(stats, args.stats_port)
+    if args.stats_file is not None:
+        dump_stats(stats, args.stats_file, args.stats_interval)
 
 
 class Socks5Server(socketserver.ThreadingTCPServer):
     """A simple Socks5 proxy server"""
 
+    # Drivers open many connections at once, and a full accept queue stalls
+    # them for a SYN retransmission timeout
+    request_queue_size = 128
+
     def __init__(self, server_address, RequestHandlerClass, args):
         socketserver.ThreadingTCPServer.__init__(
             self, server_address, RequestHandlerClass
         )
         self.args = args
         self.address_remapper = AddressRemapper(args.map)
+        self.stats = ProxyStats()
+        self.dns_cache = DnsCache(args.dns_ttl)
+        self.pool = create_connection_pool(self.address_remapper, self.dns_cache, args)
 
 
 class Socks5Handler(socketserver.BaseRequestHandler):
@@ -100,55 +700,56 @@ class Socks5Handler(socketserver.BaseRequestHandler):
         """Called after handle(), always just closes the connection"""
 
         self.request.close()
+        self.server.stats.close(self.conn)
+
+    def setup(self):
+        """Called before handle(), prepares the handshake buffer and stats"""
+
+        self.buffer = bytearray()
+        self.conn = self.server.stats.open(self.client_address)
 
     def read_exact(self, n):
-        """Read n bytes from a socket
+        """Read n bytes from the client
 
-        In Socks5, strings are prefixed with a single byte containing
-        their length. This method reads a bytes string containing n bytes
-        (where n can be a number or a bytes object containing that
-        single byte).
+        Everything the client has sent so far is received at once and
+        buffered, so a handshake message that arrives in one segment
+        takes a single recv() call instead of one per field.
 
         If reading from the client ends prematurely, this returns None.
         """
 
-        if type(n) is bytes:
-            if len(n) == 0:
-                return None
-            assert len(n) == 1
-            n = n[0]
-
-        buf = bytearray(n)
-        mv = memoryview(buf)
-        bytes_read = 0
-        while bytes_read < n:
+        while len(self.buffer) < n:
             try:
-                chunk_length = self.request.recv_into(mv[bytes_read:])
+                chunk = self.request.recv(HANDSHAKE_RECV_SIZE)
             except OSError:
                 return None
-            if chunk_length == 0:
+            if not chunk:
                 return None
+            self.buffer += chunk
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
 
-            bytes_read += chunk_length
-        return bytes(buf)
+    def read_string(self):
+        """Read a string prefixed with a single byte containing its length"""
+
+        length = self.read_exact(1)
+        if length is None:
+            return None
+        return self.read_exact(length[0])
 
     def create_outgoing_tcp_connection(self, dst, port):
-        """Create an outgoing TCP connection to dst:port"""
+        """Create an outgoing TCP connection to dst:port
 
-        outgoing = None
-        for res in socket.getaddrinfo(dst, port, socket.AF_UNSPEC, socket.SOCK_STREAM):
-            af, socktype, proto, canonname, sa = res
-            try:
-                outgoing = socket.socket(af, socktype, proto)
-            except OSError:
-                continue
-            try:
-                outgoing.connect(sa)
-            except OSError:
-                outgoing.close()
-                continue
-            break
-        return outgoing
+        An idle connection from the connection pool is used if there is one."""
+
+        if self.server.pool is not None:
+            outgoing = self.server.pool.get((dst, port))
+            if outgoing is not None:
+                return outgoing
+        return open_connection(
+            self.server.dns_cache, dst, port, self.server.args.happy_eyeballs_delay
+        )
 
     def handle(self):
         """Handle the Socks5 communication with a freshly connected client"""
@@ -165,10 +766,9 @@ class Socks5Handler(socketserver.BaseRequestHandler):
         # the socket is just fine in that case for us.
 
         # Client greeting
-        if self.request.recv(1) != b"\x05":  # Socks5 only
+        if self.read_exact(1) != b"\x05":  # Socks5 only
             return
-        n_auth = self.request.recv(1)
-        client_auth_methods = self.read_exact(n_auth)
+        client_auth_methods = self.read_string()
         if client_auth_methods is None:
             return
 
@@ -180,13 +780,10 @@ class Socks5Handler(socketserver.BaseRequestHandler):
 
         self.request.sendall(b"\x05" + required_auth_method)
         if required_auth_method == b"\x02":
-            auth_version = self.request.recv(1)
-            if auth_version != b"\x01":  # Only username/password auth v1
+            if self.read_exact(1) != b"\x01":  # Only username/password auth v1
                 return
-            username_len = self.request.recv(1)
-            username = self.read_exact(username_len)
-            password_len = self.request.recv(1)
-            password = self.read_exact(password_len)
+            username = self.read_string()
+            password = self.read_string() if username is not None else None
             if username is None or password is None:
                 return
             if (
@@ -196,38 +793,25 @@ class Socks5Handler(socketserver.BaseRequestHandler):
                 return
             self.request.sendall(b"\x01\x00")  # auth success
 
-        if self.request.recv(1) != b"\x05":  # Socks5 only
-            return
-        if self.request.recv(1) != b"\x01":  # Outgoing TCP only
-            return
-        if self.request.recv(1) != b"\x00":  # Reserved, must be 0
-            return
-
-        addrtype = self.request.recv(1)
-        dst = None
-        if addrtype == b"\x01":  # IPv4
-            ipv4raw = self.read_exact(4)
-            if ipv4raw is not None:
-                dst = ".".join(["{}"] * 4).format(*ipv4raw)
-        elif addrtype == b"\x03":  # Domain
-            domain_len = self.request.recv(1)
-            dst = self.read_exact(domain_len)
-        elif addrtype == b"\x04":  # IPv6
-            ipv6raw = self.read_exact(16)
-            if ipv6raw is not None:
-                dst = ":".join(["{:0>2x}{:0>2x}"] * 8).format(*ipv6raw)
-        else:
+        # Socks5 only, outgoing TCP only, reserved (must be 0), address type
+        request = self.read_exact(4)
+        if request is None or request[:3] != b"\x05\x01\x00":
             return
 
+        dst = self.read_address(request[3:])
         if dst is None:
             return
 
         portraw = self.read_exact(2)
+        if portraw is None:
+            return
         port = portraw[0] * 256 + portraw[1]
 
         (dst, port) = self.server.address_remapper.remap((dst, port))
 
+        self.conn.handshake_done(dst, port)
         outgoing = self.create_outgoing_tcp_connection(dst, port)
+        self.conn.connect_done(outgoing is not None)
         if outgoing is None:
             self.request.sendall(b"\x05\x01\x00")  # just report a general failure
             return
@@ -237,28 +821,310 @@ class Socks5Handler(socketserver.BaseRequestHandler):
         # of this anyway
         self.request.sendall(b"\x05\x00\x00\x01\x7f\x00\x00\x01\x10\x00")
 
+        # Pass on anything the client sent right after its request
+        if self.buffer:
+            outgoing.sendall(self.buffer)
+
         self.raw_proxy(self.request, outgoing)
 
+    def read_address(self, addrtype):
+        """Read the destination address of the given type
+
+        IP addresses are returned as text, domains as bytes, and None is
+        returned for unknown address types or when reading fails."""
+
+        if addrtype == b"\x01":  # IPv4
+            raw = self.read_exact(4)
+            return None if raw is None else socket.inet_ntoa(raw)
+        if addrtype == b"\x03":  # Domain
+            return self.read_string()
+        if addrtype == b"\x04":  # IPv6
+            raw = self.read_exact(16)
+            return None if raw is None else socket.inet_ntop(socket.AF_INET6, raw)
+        return None
+
     def raw_proxy(self, a, b):
         """Proxy data between sockets a and b as-is"""
 
-        with a, b:
+        if self.server.args.splice and splice_supported():
+            forwarder_class = SpliceForwarder
+        else:
+            forwarder_class = CopyForwarder
+
+        # Unlike select.select(), poll() is not limited to descriptors below
+        # FD_SETSIZE, which matters with many connections (and their pipes)
+        selector_class = getattr(selectors, "PollSelector", selectors.SelectSelector)
+        with a, b, selector_class() as selector:
+            for sock in (a, b):
+                sock.setblocking(False)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            forwarders = []
+            try:
+                forwarders.append(forwarder_class(a, b, self.conn.from_client))
+                forwarders.append(forwarder_class(b, a, self.conn.from_upstream))
+                # Each direction either waits for data to read from its source,
+                # or, while it still has data to send, for its destination to
+                # become writable. After EOF on either side, only the data
+                # that was already received is sent.
+                eof = False
+                while True:
+                    wanted = {a: 0, b: 0}
+                    for forwarder in forwarders:
+                        if forwarder.pending:
+                            wanted[forwarder.dst] |= selectors.EVENT_WRITE
+                        elif not eof:
+                            wanted[forwarder.src] |= selectors.EVENT_READ
+                    if not any(wanted.values()):
+                        return
+                    for sock, events in wanted.items():
+                        key = selector.get_map().get(sock)
+                        if key is None:
+                            if events:
+                                selector.register(sock, events)
+                        elif not events:
+                            selector.unregister(sock)
+                        elif key.events != events:
+                            selector.modify(sock, events)
+
+                    ready = {key.fileobj: mask for key, mask in selector.select()}
+                    for forwarder in forwarders:
+                        if forwarder.pending:
+                            if ready.get(forwarder.dst, 0) & selectors.EVENT_WRITE:
+                                forwarder.flush()
+                        elif ready.get(forwarder.src, 0) & selectors.EVENT_READ:
+                            if forwarder.fill():
+                                forwarder.flush()
+                            else:
+                                eof = True
+            finally:
+                for forwarder in forwarders:
+                    forwarder.close()
+
+
+class AsyncSocks5Server:
+    """A Socks5 proxy server that serves all connections from one asyncio event loop"""
+
+    def __init__(self, server_address, args):
+        self.server_address = server_address
+        self.args = args
+        self.address_remapper = AddressRemapper(args.map)
+        self.stats = ProxyStats()
+        self.dns_cache = DnsCache(args.dns_ttl)
+        self.pool = create_connection_pool(self.address_remapper, self.dns_cache, args)
+        self.connections = set()
+
+    async def serve_forever(self):
+        """Accept clients and handle each of them in a task of the running loop"""
+
+        loop = asyncio.get_running_loop()
+        with socket.create_server(self.server_address) as listener:
+            listener.setblocking(False)
             while True:
                 try:
-                    (readable, _, _) = select.select([a, b], [], [])
-                except (OSError, ValueError):
-                    return
-
-                if not readable:
+                    client, client_address = await loop.sock_accept(listener)
+                except OSError as e:
+                    # Like socketserver, keep serving if a single accept fails,
+                    # e.g. when a client aborts or there are too many files open
+                    print(f"Failed to accept a connection: {e}", file=sys.stderr)
+                    if e.errno in (errno.EMFILE, errno.ENFILE):
+                        # Let some connections close before trying again
+                        await asyncio.sleep(ACCEPT_RETRY_DELAY)
                     continue
-                for sock in readable:
-                    buf = sock.recv(4096)
-                    if buf == b"":
-                        return
-                    if sock is a:
-                        b.sendall(buf)
-                    else:
-                        a.sendall(buf)
+                handler = AsyncSocks5Handler(client, client_address, self)
+                task = loop.create_task(handler.run())
+                # Keep a reference so that running tasks are not garbage collected
+                self.connections.add(task)
+                task.add_done_callback(self.connections.discard)
+
+
+class AsyncSocks5Handler:
+    """Asyncio counterpart of Socks5Handler, working on non-blocking sockets"""
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.server = server
+        self.loop = asyncio.get_running_loop()
+        self.buffer = bytearray()
+        self.conn = server.stats.open(client_address)
+
+    async def run(self):
+        """Handle the connection, then always close it"""
+
+        self.request.setblocking(False)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.request:
+            try:
+                await self.handle()
+            except OSError:
+                # Closing the socket is just fine for us, as in Socks5Handler
+                pass
+            finally:
+                self.server.stats.close(self.conn)
+
+    async def read_exact(self, n):
+        """Read n bytes from the client, see Socks5Handler.read_exact"""
+
+        while len(self.buffer) < n:
+            chunk = await self.loop.sock_recv(self.request, HANDSHAKE_RECV_SIZE)
+            if not chunk:
+                return None
+            self.buffer += chunk
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_string(self):
+        """Read a string prefixed with a single byte containing its length"""
+
+        length = await self.read_exact(1)
+        if length is None:
+            return None
+        return await self.read_exact(length[0])
+
+    async def read_address(self, addrtype):
+        """Read the destination address, see Socks5Handler.read_address"""
+
+        if addrtype == b"\x01":  # IPv4
+            raw = await self.read_exact(4)
+            return None if raw is None else socket.inet_ntoa(raw)
+        if addrtype == b"\x03":  # Domain
+            return await self.read_string()
+        if addrtype == b"\x04":  # IPv6
+            raw = await self.read_exact(16)
+            return None if raw is None else socket.inet_ntop(socket.AF_INET6, raw)
+        return None
+
+    async def create_outgoing_tcp_connection(self, dst, port):
+        """Create an outgoing TCP connection to dst:port
+
+        See Socks5Handler.create_outgoing_tcp_connection."""
+
+        if self.server.pool is not None:
+            outgoing = self.server.pool.get((dst, port))
+            if outgoing is not None:
+                outgoing.setblocking(False)
+                return outgoing
+        dns_cache = self.server.dns_cache
+        addrs = dns_cache.lookup(dst, port)
+        if addrs is None:
+            try:
+                # Numeric addresses need no lookup, so skip the executor thread
+                addrs = socket.getaddrinfo(
+                    dst,
+                    port,
+                    socket.AF_UNSPEC,
+                    socket.SOCK_STREAM,
+                    0,
+                    socket.AI_NUMERICHOST,
+                )
+            except socket.gaierror:
+                addrs = await self.loop.getaddrinfo(
+                    dst, port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM
+                )
+            dns_cache.store(dst, port, addrs)
+        return await async_happy_eyeballs_connect(
+            self.loop, addrs, self.server.args.happy_eyeballs_delay
+        )
+
+    async def handle(self):
+        """Handle the Socks5 communication with a freshly connected client
+
+        See Socks5Handler.handle for the protocol details."""
+
+        # Client greeting
+        if await self.read_exact(1) != b"\x05":  # Socks5 only
+            return
+        client_auth_methods = await self.read_string()
+        if client_auth_methods is None:
+            return
+
+        # choose either no-auth or username/password
+        required_auth_method = b"\x00" if self.server.args.auth is None else b"\x02"
+        if required_auth_method not in client_auth_methods:
+            await self.loop.sock_sendall(self.request, b"\x05\xff")
+            return
+
+        await self.loop.sock_sendall(self.request, b"\x05" + required_auth_method)
+        if required_auth_method == b"\x02":
+            if await self.read_exact(1) != b"\x01":  # Only username/password auth v1
+                return
+            username = await self.read_string()
+            password = await self.read_string() if username is not None else None
+            if username is None or password is None:
+                return
+            if (
+                username.decode("utf8") + ":" + password.decode("utf8")
+                != self.server.args.auth
+            ):
+                return
+            await self.loop.sock_sendall(self.request, b"\x01\x00")  # auth success
+
+        # Version, outgoing TCP only, reserved and address type
+        request = await self.read_exact(4)
+        if request is None or request[:3] != b"\x05\x01\x00":
+            return
+
+        dst = await self.read_address(request[3:])
+        if dst is None:
+            return
+
+        portraw = await self.read_exact(2)
+        if portraw is None:
+            return
+        port = portraw[0] * 256 + portraw[1]
+
+        (dst, port) = self.server.address_remapper.remap((dst, port))
+
+        self.conn.handshake_done(dst, port)
+        try:
+            outgoing = await self.create_outgoing_tcp_connection(dst, port)
+        except OSError:
+            outgoing = None
+        self.conn.connect_done(outgoing is not None)
+        if outgoing is None:
+            # just report a general failure
+            await self.loop.sock_sendall(self.request, b"\x05\x01\x00")
+            return
+        # success response, see Socks5Handler.handle
+        await self.loop.sock_sendall(
+            self.request, b"\x05\x00\x00\x01\x7f\x00\x00\x01\x10\x00"
+        )
+
+        with outgoing:
+            outgoing.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Pass on anything the client sent right after its request
+            if self.buffer:
+                await self.loop.sock_sendall(outgoing, self.buffer)
+            await self.raw_proxy(self.request, outgoing)
+
+    async def raw_proxy(self, a, b):
+        """Proxy data between sockets a and b as-is until either side is done"""
+
+        tasks = [
+            self.loop.create_task(self.forward(a, b, self.conn.from_client)),
+            self.loop.create_task(self.forward(b, a, self.conn.from_upstream)),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def forward(self, src, dst, count):
+        """Copy data from src to dst through a single reusable buffer"""
+
+        buf = bytearray(BUFFER_SIZE)
+        mv = memoryview(buf)
+        while True:
+            try:
+                n = await self.loop.sock_recv_into(src, buf)
+                if n == 0:
+                    return
+                await self.loop.sock_sendall(dst, mv[:n])
+                count(n)
+            except OSError:
+                return
 
 
 def main():
@@ -266,10 +1132,68 @@ def main():
     parser.add_argument("--port", type=int, required=True)
     parser.add_argument("--auth", type=str)
     parser.add_argument("--map", type=str, action="append", default=[])
+    parser.add_argument(
+        "--no-splice",
+        dest="splice",
+        action="store_false",
+        help="Copy proxied data through Python buffers even where os.splice() "
+        "is available (threaded mode only)",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Serve all connections from a single asyncio event loop "
+        "instead of using one thread per connection",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        help="Serve connection and traffic stats as JSON on this localhost port",
+    )
+    parser.add_argument(
+        "--stats-file", help="Periodically write connection and traffic stats as JSON"
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=10,
+        help="Seconds between writes of --stats-file (Default is 10)",
+    )
+    parser.add_argument(
+        "--dns-ttl",
+        type=float,
+        default=30,
+        help="Seconds for which resolved target addresses are cached, "
+        "0 disables the cache (Default is 30)",
+    )
+    parser.add_argument(
+        "--happy-eyeballs-delay",
+        type=float,
+        default=0.25,
+        help="Seconds after which the next address of a target is tried while "
+        "earlier connection attempts are still pending (Default is 0.25)",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=0,
+        help="Keep this many idle connections open to every --map destination "
+        "(Default is 0)",
+    )
     args = parser.parse_args()
 
+    if args.asyncio:
+        server = AsyncSocks5Server(("localhost", args.port), args)
+        start_stats(server.stats, args)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        return
+
     socketserver.TCPServer.allow_reuse_address = True
     with Socks5Server(("localhost", args.port), Socks5Handler, args) as server:
+        start_stats(server.stats, args)
         server.serve_forever()
 
 
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Benchmark socks5srv against a local echo server.
+
+socks5srv is started as a separate process on localhost, in the mode selected
+by the proxy arguments. Every workload runs once directly against the echo
+server and once through the proxy, so the cost of the proxy can be told apart
+from the cost of the client and the echo server:
+
+  bulk   Several connections send data and read it back at the same time.
+  short  Many connections, a few at a time, each doing the handshake, one
+         small round trip and closing.
+
+The results, including the stats that the proxy collected itself, are written
+as JSON.
+
+Use '--help' for more information.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import logging
+import platform
+import socket
+import socketserver
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+
+HERE = Path(__file__).absolute().parent
+SOCKS5SRV = HERE.parent / "socks5srv.py"
+
+#: Size of the writes and reads of the clients and the echo server.
+CHUNK_SIZE = 256 * 1024
+
+#: Payload of the round trip done by every short connection.
+SHORT_PAYLOAD = b"x" * 64
+
+
+class _EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        buf = memoryview(bytearray(CHUNK_SIZE))
+        with contextlib.suppress(OSError):
+            while True:
+                n = self.request.recv_into(buf)
+                if not n:
+                    return
+                self.request.sendall(buf[:n])
+
+
+class _EchoServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # The short workload opens many connections at once.
+    request_queue_size = 1024
+
+
+@contextlib.contextmanager
+def _serve_echo():
+    """
+    Serve an echo server on an ephemeral localhost port. Yields the port.
+    """
+    server = _EchoServer(("127.0.0.1", 0), _EchoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def _run_proxy(args: argparse.Namespace):
+    """
+    Start socks5srv. Yields its (port, stats_port).
+    """
+    port, stats_port = _free_port(), _free_port()
+    cmd = [sys.executable, str(SOCKS5SRV), "--port", str(port)]
+    cmd += ["--stats-port", str(stats_port)]
+    if args.auth:
+        cmd += ["--auth", args.auth]
+    if args.asyncio:
+        cmd.append("--asyncio")
+    if not args.splice:
+        cmd.append("--no-splice")
+    LOGGER.debug("Starting %s", cmd)
+    proc = subprocess.Popen(cmd)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("localhost", port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("socks5srv did not start") from None
+                time.sleep(0.05)
+        yield port, stats_port
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise RuntimeError("Connection closed during the Socks5 handshake")
+        data += chunk
+    return data
+
+
+def _connect(
+    echo_port: int, proxy_port: "int | None", auth: "str | None"
+) -> socket.socket:
+    """
+    Connect to the echo server, through the proxy if 'proxy_port' is given.
+    """
+    if proxy_port is None:
+        sock = socket.create_connection(("127.0.0.1", echo_port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    sock = socket.create_connection(("localhost", proxy_port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    method = b"\x02" if auth else b"\x00"
+    sock.sendall(b"\x05\x01" + method)
+    if _recv_exact(sock, 2) != b"\x05" + method:
+        raise RuntimeError("The proxy rejected the authentication method")
+    if auth:
+        user, password = (part.encode("utf8") for part in auth.split(":", 1))
+        sock.sendall(
+            b"\x01" + bytes([len(user)]) + user + bytes([len(password)]) + password
+        )
+        if _recv_exact(sock, 2) != b"\x01\x00":
+            raise RuntimeError("The proxy rejected the credentials")
+    sock.sendall(
+        b"\x05\x01\x00\x01"
+        + socket.inet_aton("127.0.0.1")
+        + struct.pack(">H", echo_port)
+    )
+    if _recv_exact(sock, 10)[:2] != b"\x05\x00":
+        raise RuntimeError("The proxy could not connect to the echo server")
+    return sock
+
+
+def _bulk(echo_port: int, proxy_port: "int | None", args: argparse.Namespace) -> float:
+    """
+    Send --bulk-size MiB on each of --bulk-connections connections and read it
+    back. Returns the throughput in MiB/s, counting each byte once.
+    """
+    total = args.bulk_size * 1024 * 1024
+    chunk = b"\xa5" * CHUNK_SIZE
+
+    def send(sock: socket.socket) -> None:
+        sent = 0
+        while sent < total:
+            sock.sendall(chunk[: total - sent])
+            sent += min(CHUNK_SIZE, total - sent)
+
+    def receive(sock: socket.socket) -> None:
+        buf = memoryview(bytearray(CHUNK_SIZE))
+        received = 0
+        while received < total:
+            n = sock.recv_into(buf)
+            if not n:
+                raise RuntimeError("Connection closed during the bulk transfer")
+            received += n
+
+    socks = [
+        _connect(echo_port, proxy_port, args.auth) for _ in range(args.bulk_connections)
+    ]
+    try:
+        workers = 2 * len(socks)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(fn, sock) for sock in socks for fn in (send, receive)
+            ]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        for sock in socks:
+            sock.close()
+    return args.bulk_size * len(socks) / elapsed
+
+
+def _short(
+    echo_port: int, proxy_port: "int | None", args: argparse.Namespace
+) -> "tuple[float, list[float]]":
+    """
+    Open --short-connections connections, --concurrency at a time, each doing
+    one small round trip. Returns the connections per second and the latency
+    of every connection in seconds.
+    """
+
+    def once(_: int) -> float:
+        start = time.perf_counter()
+        with _connect(echo_port, proxy_port, args.auth) as sock:
+            sock.sendall(SHORT_PAYLOAD)
+            _recv_exact(sock, len(SHORT_PAYLOAD))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        latencies = list(pool.map(once, range(args.short_connections)))
+    return args.short_connections / (time.perf_counter() - start), latencies
+
+
+def _summarize(samples: "list[float]") -> "dict[str, float]":
+    ordered = sorted(samples)
+    return {
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p99": ordered[len(ordered) * 99 // 100],
+        "max": ordered[-1],
+    }
+
+
+def _run(
+    echo_port: int, proxy_port: "int | None", args: argparse.Namespace
+) -> "dict[str, dict[str, float]]":
+    """
+    Run every workload --iterations times, directly or through the proxy.
+    """
+    bulk, rates, latencies = [], [], []
+    for _ in range(args.iterations):
+        bulk.append(_bulk(echo_port, proxy_port, args))
+        rate, samples = _short(echo_port, proxy_port, args)
+        rates.append(rate)
+        latencies += samples
+    return {
+        "bulk_mib_per_s": _summarize(bulk),
+        "short_connections_per_s": _summarize(rates),
+        "short_latency_s": _summarize(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Whether to log at the DEBUG level"
+    )
+    parser.add_argument(
+        "--iterations",
+        "-n",
+        type=int,
+        default=3,
+        help="The number of times to run every workload (Default is 3)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="-",
+        metavar="FILE",
+        help="Write the results as JSON to this file (Default is stdout)",
+    )
+    load_grp = parser.add_argument_group("Workload arguments")
+    load_grp.add_argument(
+        "--bulk-size",
+        type=int,
+        default=64,
+        metavar="MiB",
+        help="The amount of data sent on every bulk connection (Default is 64)",
+    )
+    load_grp.add_argument(
+        "--bulk-connections",
+        type=int,
+        default=4,
+        help="The number of concurrent bulk connections (Default is 4)",
+    )
+    load_grp.add_argument(
+        "--short-connections",
+        type=int,
+        default=2000,
+        help="The number of short connections (Default is 2000)",
+    )
+    load_grp.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="The number of short connections open at a time (Default is 16)",
+    )
+    proxy_grp = parser.add_argument_group(
+        "Proxy arguments", description="Passed on to socks5srv."
+    )
+    proxy_grp.add_argument(
+        "--asyncio", action="store_true", help="Run socks5srv in asyncio mode"
+    )
+    proxy_grp.add_argument(
+        "--no-splice",
+        dest="splice",
+        action="store_false",
+        help="Do not let socks5srv use os.splice()",
+    )
+    proxy_grp.add_argument(
+        "--auth", metavar="USER:PASSWORD", help="Require username/password auth"
+    )
+    args = parser.parse_args(argv)
+    if args.verbose:
+        LOGGER.setLevel(logging.DEBUG)
+
+    with _serve_echo() as echo_port:
+        LOGGER.info("Running the workloads directly against the echo server")
+        direct = _run(echo_port, None, args)
+        with _run_proxy(args) as (proxy_port, stats_port):
+            LOGGER.info("Running the workloads through socks5srv")
+            proxied = _run(echo_port, proxy_port, args)
+            url = f"http://localhost:{stats_port}/"
+            with urllib.request.urlopen(url) as resp:
+                proxy_stats = json.load(resp)
+
+    # The per-connection lists are not useful after the run.
+    proxy_stats.pop("active", None)
+    proxy_stats.pop("recent", None)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "iterations": args.iterations,
+            "bulk_size_mib": args.bulk_size,
+            "bulk_connections": args.bulk_connections,
+            "short_connections": args.short_connections,
+            "concurrency": args.concurrency,
+            "asyncio": args.asyncio,
+            "splice": args.splice,
+            "auth": bool(args.auth),
+        },
+        "direct": direct,
+        "proxy": proxied,
+        # How much of the direct performance is left with the proxy, using the
+        # median of each workload.
+        "proxy_ratio": {
+            name: proxied[name]["median"] / direct[name]["median"]
+            for name in ("bulk_mib_per_s", "short_connections_per_s")
+        },
+        "proxy_stats": proxy_stats,
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,9 +29,49 @@ fi
 
 ./mongodl --edition enterprise --version 7.0 --component archive --test --retries 5
 ./mongodl --edition enterprise --version 7.0 --component cryptd --out ${DOWNLOAD_DIR} --strip-path-components 1 --retries 5
+echo '[{"component": "archive"}, {"component": "crypt_shared", "strip_components": 1}]' | ./mongodl --edition enterprise --version 7.0 --batch - --test --retries 5
+./mongodl --edition enterprise --version 8.0 --component archive --test --segments 4 --retries 5
+./mongodl --gc --cache-max-size 10G
+./mongodl --edition enterprise --version 7.0 --component archive --test --offline
 ./mongosh-dl --no-download
 ./mongosh-dl --version 2.1.1 --no-download
 
+if [ "${OS:-}" != "Windows_NT" ]; then
+  # Ensure that archives with symbolic and hard links can be extracted.
+  rm -rf links_test
+  mkdir -p links_test/pkg/bin links_test/pkg/lib/real
+  echo tool >links_test/pkg/bin/tool
+  echo lib >links_test/pkg/lib/real/libx.so.1
+  ln -s real/libx.so.1 links_test/pkg/lib/libx.so
+  ln -s real links_test/pkg/lib/current
+  ln links_test/pkg/bin/tool links_test/pkg/bin/tool-hard
+  tar -czf links_test/links.tgz -C links_test pkg
+  . ./find-python3.sh
+  PYTHON=$(ensure_python3 2>/dev/null)
+  # Serve the archive from a local downloads list.
+  sha256=$($PYTHON -c "import hashlib, sys; print(hashlib.sha256(open(sys.argv[1], 'rb').read()).hexdigest())" links_test/links.tgz)
+  cat <<EOF >links_test/full.json
+{"versions": [{"version": "99.0.0", "githash": "links", "date": "2024-01-01",
+  "downloads": [{"target": "ubuntu2204", "arch": "x86_64", "edition": "enterprise",
+  "archive": {"url": "http://localhost:8100/links.tgz", "sha256": "$sha256"}}]}]}
+EOF
+  $PYTHON -m http.server --bind 127.0.0.1 --directory links_test 8100 >/dev/null 2>&1 &
+  server_pid=$!
+  sleep 1
+  if ! MONGODB_DOWNLOAD_SOURCE=http://localhost:8100/full.json ./mongodl --cache-dir links_test/cache \
+    --version 99.0.0 --target ubuntu2204 --arch x86_64 --edition enterprise --component archive \
+    --out links_test/out --strip-path-components 1 --retries 5; then
+    kill $server_pid
+    exit 1
+  fi
+  kill $server_pid
+  test -L links_test/out/lib/libx.so
+  test -L links_test/out/lib/current
+  grep lib links_test/out/lib/current/libx.so.1
+  grep tool links_test/out/bin/tool-hard
+  rm -rf links_test
+fi
+
 export PATH="${DOWNLOAD_DIR}/bin:$PATH"
 if [ "${OS:-}" != "Windows_NT" ]; then
   ./mongosh-dl --version 2.1.1 --out ${DOWNLOAD_DIR} --strip-path-components 1 --retries 5
@@ -48,6 +88,30 @@ bash install-cli.sh "$(pwd)/orchestration"
 ${DOWNLOAD_DIR}/mongod --version | grep v7.0
 ./orchestration/drivers-orchestration stop
 
+# Ensure that the native launcher can start a replica set.
+./orchestration/drivers-orchestration run --existing-binaries-dir=${DOWNLOAD_DIR} --native-launcher --topology replica_set
+./orchestration/drivers-orchestration stop
+
+# Ensure that the native launcher can start deployments with auth and
+# TLS, without falling back to mongo-orchestration.
+for native_args in "--topology replica_set --auth" "--topology sharded_cluster --auth --ssl"; do
+  if ! ./orchestration/drivers-orchestration run --existing-binaries-dir=${DOWNLOAD_DIR} --native-launcher $native_args >native.log 2>&1; then
+    cat native.log
+    exit 1
+  fi
+  cat native.log
+  if grep "Using mongo-orchestration" native.log; then
+    exit 1
+  fi
+  ./orchestration/drivers-orchestration stop
+done
+rm -f native.log
+
+# Ensure that a second run reuses the deployment of the first one.
+./orchestration/drivers-orchestration run --existing-binaries-dir=${DOWNLOAD_DIR} --reuse-deployment
+./orchestration/drivers-orchestration run --existing-binaries-dir=${DOWNLOAD_DIR} --reuse-deployment 2>&1 | grep "Resetting deployment... done."
+./orchestration/drivers-orchestration stop
+
 # Ensure we can use a downloaded mongodb directory in start-orchestration.
 ./orchestration/drivers-orchestration start --mongodb-binaries=${DOWNLOAD_DIR}
 ./orchestration/drivers-orchestration stop